@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+## Register bimEdit commands when this folder is installed as a FreeCAD module
+## (e.g. in the Mod directory). Heavy modules are imported at first use
+
+import bimEdit_command
+bimEdit_command.register()
@@ -43,18 +43,26 @@
 ## - when selection is ok you can launch the transformation pressing:
 ##      - g -> to move
 ##      - r -> to rotate
-##      - (scale, mirror and stretch will come)
+##      - s -> to scale
+##      - (mirror and stretch will come)
+## - holding Shift with g or r asks for a number of copies and creates
+##   a linear or polar array of the selection
 
 
-import FreeCAD, FreeCADGui, Draft
+import FreeCAD, FreeCADGui, Draft, Part, os, time
 from DraftGui import translate, utf8_decode
 from DraftTools import Modifier, msg, selectObject
 from DraftTrackers import Tracker, ghostTracker
-import re
 from pivy import coin
-from pivy.coin import *
+from pivy.coin import SoAnnotation, SoBaseKit, SoCoordinate3, SoDrawStyle, \
+        SoIndexedFaceSet, SoIndexedLineSet, SoMaterial, SoPickStyle, \
+        SoPointSet, SoSeparator, SoShape, SoShapeHints, SoTransform
+from PySide import QtCore, QtGui
 
-from bimEdit_overrides import bimMove, bimRotate
+from bimEdit_overrides import bimMove, bimRotate, bimScale
+import bimEdit_core
+from bimEdit_core import profiler, profiled, recomputer, selectionOption, \
+        expressionIndexes, SelectionRegistry
 
 ### Utilities ###
 
@@ -75,67 +83,136 @@ def traverse_node(node, out=''):
 normalizeNormal = lambda obj: obj.Normal if obj.Normal != FreeCAD.Vector(0,0,0) \
         else FreeCAD.Vector(0,0,1)
 
-pickSelection = lambda sel, sel_type: \
-        [o for o in sel if o.selectionType == sel_type]
-
-def selectionOption(sel=[]):
-    ''' Entities are collected as four lists: 
-     - normal (nothing happens to them)
-     - to edit (actual editing objects), 
-     - directed dependencies (objects based on selection),
-     - expressions dependencies (dependencies called by expressions) '''
-
-    return {
-        '0_obj': {
-            'normal': pickSelection(sel, 'addition') + \
-                    pickSelection(sel, 'main_base'),
-            'toEdit': pickSelection(sel, 'main'),
-            'dirDeps': [],
-            'exprDeps': pickSelection(sel, 'main_dependency'),
-            'print' : 'The OBJECTS you clicked will be edited.\n' + \
-                    'Eventually bases and additions will not be affected. ' + \
-                    'Copies will point to the same bases'
-            },
-        '1_obj_base': {
-            'normal': pickSelection(sel, 'addition_base') + \
-                    pickSelection(sel, 'main_dependency') + \
-                    pickSelection(sel, 'addition'),
-            'toEdit': pickSelection(sel, 'main_base'),
-            'dirDeps': pickSelection(sel, 'main'),
-            'exprDeps': pickSelection(sel, 'main_base_dependency'),
-            'print' : 'The BASES of the OBJECTS you clicked will be edited.' + \
-                    '\nDirected dependencies, like the objects that are ' + \
-                    'based on them, will be affected. Copying will create ' + \
-                    'new bases and new objects based on them'
-            },
-        '2_obj_addition': {
-            'normal': pickSelection(sel, 'addition_base') + \
-                    pickSelection(sel, 'main_base'),
-            'toEdit': pickSelection(sel, 'main') + \
-                    pickSelection(sel, 'addition'),
-            'dirDeps': [],
-            'exprDeps': pickSelection(sel, 'main_dependency') + \
-                    pickSelection(sel, 'addition_dependency'),
-            'print' : 'The OBJECTS you clicked and their ADDITIONS will ' + \
-                    'be edited.\nEventually bases will not be affected. ' + \
-                    'Copies will point to the same bases'
-            },
-        '3_obj_addition_base': {
-            'normal': pickSelection(sel, 'main_dependency'),
-            'toEdit': pickSelection(sel, 'main_base') + \
-                    pickSelection(sel, 'addition_base'),
-            'dirDeps': pickSelection(sel, 'main') + \
-                    pickSelection(sel, 'addition'),
-            'exprDeps': pickSelection(sel, 'main_base_dependency') + \
-                    pickSelection(sel, 'addition_base_dependency'),
-            'print' : 'The BASES of the OBJECTS you clicked and ' + \
-                    'their ADDITIONS will be edited.\n' + \
-                    'Directed dependencies, like the objects that are ' + \
-                    'based on them, will be affected. Copying will create ' + \
-                    'new bases and new objects based on them. ' + \
-                    'Relations between additions will be maintained'
-            }
-    }
+## Ghosts created later are drawn over the previous ones: 
+## dependencies go first and 2d objects last
+ghostOrder = lambda so: (not so.isDependency) + \
+        ('Part2DObject' in so.obj.TypeId)
+
+
+def shapeNode(shape):
+    ''' Return a coin representation of shape '''
+    buf = coin.SoInput()
+    buf.setBuffer(shape.writeInventor())
+    return coin.SoDB.readAll(buf)
+
+class DocumentCache(dict):
+    ''' A dict keyed by (document name, object name) whose entries are
+    dropped as soon as their object changes or is deleted, or their
+    document is closed '''
+
+    def __setitem__(self, key, value):
+        if not getattr(self, 'observed', False):
+            FreeCAD.addDocumentObserver(self)
+            self.observed = True
+        super().__setitem__(key, value)
+
+    ## Document observer slots
+
+    def slotChangedObject(self, obj, prop):
+        self.pop((obj.Document.Name, obj.Name), None)
+
+    def slotDeletedObject(self, obj):
+        self.pop((obj.Document.Name, obj.Name), None)
+
+    def slotDeletedDocument(self, doc):
+        for key in [k for k in self if k[0] == doc.Name]:
+            del self[key]
+
+## Pristine copies of the coin representation of objects, shared by all 
+## the SelectedObject of the same object. They are kept between the runs 
+## of the command until their object changes
+pristineNodes = DocumentCache()
+
+## Shapes of objects without their additions (the shape before the boolean
+## operations), computed without touching the document (see getShape)
+ownShapes = DocumentCache()
+
+def getShape(obj):
+    ''' Return the shape of obj without its additions or None if it 
+    can't be computed (see buildShape) '''
+    key = (obj.Document.Name, obj.Name)
+    if key not in ownShapes:
+        ownShapes[key] = buildShape(obj)
+    return ownShapes[key]
+
+def buildShape(obj):
+    ''' Rebuild the extruded base of an Arch object the same way its 
+    execute does (one extrusion vector or path and one placement per 
+    profile, as structures have), then cut its subtractions and the
+    windows hosted by it, and place it at obj.Placement. It stops 
+    before additions get fused. None if anything goes wrong '''
+    if not hasattr(obj, 'Proxy') or \
+            not hasattr(obj.Proxy, 'getExtrusionData'):
+        return None
+    try:
+        data = obj.Proxy.getExtrusionData(obj)
+        if not data:
+            return None
+        bases, extvs, pls = [d if isinstance(d, list) else [d] \
+                for d in data[:3]]
+        shapes = []
+        for i, base in enumerate(bases):
+            extv = extvs[min(i, len(extvs) - 1)]
+            pl = pls[min(i, len(pls) - 1)]
+            base = base.copy()
+            base.Placement = pl.multiply(base.Placement)
+            if isinstance(extv, FreeCAD.Vector):
+                shapes.append(base.extrude(pls[0].Rotation.multVec(extv)))
+            else:
+                shapes.append(extv.makePipe(base))
+        shape = shapes[0] if len(shapes) == 1 else \
+                Part.makeCompound(shapes)
+        ## Subtraction volumes are global: they are brought in the
+        ## coordinates of the shape before the cut
+        inverse = obj.Placement.inverse()
+        subs = list(getattr(obj, 'Subtractions', []))
+        subs += [o for o in obj.InList \
+                if obj in getattr(o, 'Hosts', []) and o not in subs]
+        for sub in subs:
+            volume = sub.Proxy.getSubVolume(sub) \
+                    if hasattr(sub.Proxy, 'getSubVolume') else sub.Shape
+            if volume and shape.Solids and volume.Solids:
+                volume = volume.copy()
+                volume.Placement = inverse.multiply(volume.Placement)
+                shape = shape.cut(volume)
+        shape.Placement = obj.Placement.multiply(shape.Placement)
+        return shape
+    except Exception:
+        return None
+
+## View properties of the objects hidden behind their ghosts, as they were 
+## before: (document name, object name) -> {attribute: value}
+hiddenViews = {}
+
+class ViewStateBatch:
+    ''' Collect the changes of view properties of a selection cycle and
+    apply them at once: notifications of the scene graph are suspended 
+    meanwhile, so that the view is redrawn only once '''
+
+    def __init__(self):
+        ## (object name, property) -> (view object, value): the last 
+        ## change of a property wins
+        self.changes = {}
+
+    def set(self, vobj, attr, value):
+        self.changes[(vobj.Object.Name, attr)] = (vobj, value)
+
+    def apply(self):
+        ''' Apply the collected changes and redraw once '''
+        view = FreeCADGui.ActiveDocument.ActiveView if \
+                FreeCADGui.ActiveDocument else None
+        sg = view.getSceneGraph() if hasattr(view, 'getSceneGraph') else None
+        if sg:
+            notify = sg.isNotifyEnabled()
+            sg.enableNotify(False)
+        try:
+            for (name, attr), (vobj, value) in self.changes.items():
+                setattr(vobj, attr, value)
+        finally:
+            self.changes = {}
+            if sg:
+                sg.enableNotify(notify)
+                sg.touch()
 
 selectionVisibility = { ## Attributes for different selection conditions
         'Transparency': {'toEdit': .80, 'dirDeps': .80, 'exprDeps': .80},
@@ -154,218 +231,518 @@ hideAttribute = { ## Attributes for temporarily hiding objects
         'LineWidth': 1.0
         }
 
+settings = { ## Behaviour of the command
+        ## All the ghosts of a selection type share a single tracker
+        'batchGhosts': False,
+        ## Transformations handle only the latest mouse movement of every
+        ## frame (frames per second in frameRate) and report their latency
+        'framePaced': False,
+        'frameRate': 60,
+        ## Time the phases of the command and print a report when it ends
+        ## (and write it as JSON to profileFile, if any)
+        'profile': False,
+        'profileFile': '',
+        ## Print what the command keeps in memory when it ends
+        ## (see memoryUsage)
+        'memoryReport': False,
+        ## Ghosts are built in slices of this many milliseconds, letting
+        ## the Gui respond between them (0 builds them all at once)
+        'ghostSlice': 30,
+        ## Ghosts of objects with more than lodTriangles triangles, and all
+        ## the ghosts when more than lodObjects objects are involved, are
+        ## drawn as lodMode: 'box' (bounding box edges), 'edges' (no faces),
+        ## 'decimated' (faces with fewer vertices) or 'full'
+        'lodTriangles': 20000,
+        'lodObjects': 2000,
+        'lodMode': 'decimated',
+        ## Grid cells along the longest side of decimated objects
+        'lodResolution': 16,
+        ## Side (mm) of the grid cells of the snap index of bimMove and 
+        ## bimRotate (see bimEdit_overrides.staticSnapIndex)
+        'snapCell': 1000.,
+        }
+
+## Batch ghosts are created in this order (the last ones are on top)
+batchOrder = ['exprDeps', 'normal', 'dirDeps', 'toEdit']
+
+## Ghosts of these selection types follow the transformation preview
+movingTypes = ['toEdit', 'dirDeps']
+
+## Ghosts are built in this order (most important first)
+ghostPriority = ['toEdit', 'dirDeps', 'normal', 'exprDeps']
+
 ######
 
+ghostStyles = {} ## Selection type -> shared style nodes (see getGhostStyle)
+
+def getGhostStyle(typ):
+    ''' Return, for every kind of shape, the coin nodes giving ghosts the
+    look of selection type typ. They are created once and shared by all 
+    the ghosts of that type '''
+    if typ not in ghostStyles:
+        hints = SoShapeHints()
+        hints.vertexOrdering.setValue(1)
+        ghostStyles[typ] = {}
+        for shape, transparency, lineWidth in [
+                (SoIndexedFaceSet, 'Transparency', 'FaceLineWidth'),
+                (SoIndexedLineSet, 'LineTransparency', 'LineWidth'),
+                (SoPointSet, 'LineTransparency', 'LineWidth')]:
+            material = SoMaterial()
+            material.diffuseColor.setValue(
+                    selectionVisibility['LineColor'][typ])
+            material.emissiveColor.setValue(
+                    selectionVisibility['FaceColor'][typ])
+            material.transparency.setValue(
+                    selectionVisibility[transparency][typ])
+            style = SoDrawStyle()
+            style.lineWidth.setValue(selectionVisibility[lineWidth][typ])
+            style.pointSize.setValue(selectionVisibility[lineWidth][typ])
+            ghostStyles[typ][shape] = {
+                    SoMaterial: material,
+                    SoDrawStyle: style,
+                    SoShapeHints: hints}
+    return ghostStyles[typ]
+
+def findPaths(node, typ):
+    ''' Return a path from node to every node of type typ below it. A
+    node reached through several paths (the flat root of shapes is shared
+    by display modes) is returned once '''
+    search = coin.SoSearchAction()
+    search.setType(typ.getClassTypeId())
+    search.setInterest(search.ALL)
+    search.setSearchingAll(True)
+    SoBaseKit.setSearchingChildren(True)
+    search.apply(node)
+    paths = {}
+    for path in search.getPaths():
+        if path:
+            paths.setdefault(path.getTail().getNodeId(), path)
+    return list(paths.values())
+
+def styleGhost(sep, typ):
+    ''' Give sep the look of selection type typ in a single traversal:
+    material, draw style and shape hints of every shape are replaced by
+    the shared nodes of getGhostStyle (missing ones are inserted) '''
+    styles = getGhostStyle(typ)
+    for path in findPaths(sep, SoShape):
+        shape = path.getTail()
+        style = [styles[sh] for sh in styles \
+                if shape.isOfType(sh.getClassTypeId())]
+        if not style:
+            continue
+        style = style[0]
+        parent = path.getNodeFromTail(1)
+        found = set()
+        for i in range(parent.getNumChildren()):
+            for node in style:
+                if parent.getChild(i).isOfType(node.getClassTypeId()):
+                    parent.replaceChild(i, style[node])
+                    found.add(node)
+        ## Representations made from shapes have no material or draw style
+        for node in [SoMaterial, SoDrawStyle]:
+            if node not in found:
+                parent.insertChild(style[node], parent.findChild(shape))
+
+### Level of detail ###
+
+## Triangles drawn by the pristine node of every object
+ghostTriangles = DocumentCache()
+## Simplified copies of the pristine nodes: detail -> coin node
+simplifiedNodes = DocumentCache()
+
+def countTriangles(node):
+    ''' Return the number of triangles drawn by the face sets below node
+    (every triangle takes four indices) '''
+    return sum(path.getTail().coordIndex.getNum() // 4 \
+            for path in findPaths(node, SoIndexedFaceSet))
+
+def ghostDetail(so, typ, crowded=False):
+    ''' Return how the ghost of so as typ is drawn: 'full' or, for heavy 
+    objects (see settings['lodTriangles']) and crowded selections 
+    (see settings['lodObjects']), settings['lodMode']. 'normal' ghosts 
+    are drawn in full, they stand for the hidden objects '''
+    if typ == 'normal' or settings['lodMode'] == 'full':
+        return 'full'
+    key = (so.obj.Document.Name, so.name)
+    if key not in ghostTriangles:
+        ghostTriangles[key] = countTriangles(so.pristine)
+    if crowded or ghostTriangles[key] > settings['lodTriangles']:
+        return settings['lodMode']
+    return 'full'
+
+def boxNode(obj):
+    ''' Return the edges of the bounding box of the shape of obj 
+    (None if it has no shape) '''
+    shape = getattr(obj, 'Shape', None)
+    if not shape or shape.isNull():
+        return None
+    bb = shape.BoundBox
+    points = [(x, y, z) for z in (bb.ZMin, bb.ZMax) \
+            for y in (bb.YMin, bb.YMax) for x in (bb.XMin, bb.XMax)]
+    index = [0, 1, 3, 2, 0, -1, 4, 5, 7, 6, 4, -1,
+            0, 4, -1, 1, 5, -1, 2, 6, -1, 3, 7, -1]
+    sep = SoSeparator()
+    coords = SoCoordinate3()
+    coords.point.setValues(0, len(points), points)
+    lines = SoIndexedLineSet()
+    lines.coordIndex.setValues(0, len(index), index)
+    sep.addChild(coords)
+    sep.addChild(lines)
+    return sep
+
+def coordinatesOf(path):
+    ''' Return the SoCoordinate3 used by the shape at the tail of path
+    (the last one met before it), None if missing '''
+    for i in range(1, path.getLength()):
+        parent = path.getNodeFromTail(i)
+        index = parent.findChild(path.getNodeFromTail(i - 1))
+        for j in range(index - 1, -1, -1):
+            if parent.getChild(j).isOfType(SoCoordinate3.getClassTypeId()):
+                return parent.getChild(j)
+    return None
+
+def decimate(faces, coords):
+    ''' Return a face set drawing faces (a SoIndexedFaceSet using coords)
+    with fewer vertices: vertices are merged in cells of a grid 
+    (settings['lodResolution'] cells along the longest side) and the faces 
+    collapsing to lines or points are dropped '''
+    points = [(p[0], p[1], p[2]) for p in coords.point.getValues()]
+    index = []
+    if points:
+        lows = [min(p[k] for p in points) for k in range(3)]
+        size = max(max(p[k] for p in points) - lows[k] for k in range(3)) \
+                / settings['lodResolution'] or 1.
+        cells = {}
+        merged = [cells.setdefault(tuple(int((p[k] - lows[k]) // size) \
+                for k in range(3)), i) for i, p in enumerate(points)]
+        seen = set()
+        face = []
+        for i in list(faces.coordIndex.getValues()) + [-1]:
+            if i >= 0:
+                if i < len(merged) and (not face or face[-1] != merged[i]):
+                    face.append(merged[i])
+                continue
+            if len(set(face)) >= 3 and frozenset(face) not in seen:
+                seen.add(frozenset(face))
+                index += face + [-1]
+            face = []
+    node = SoIndexedFaceSet()
+    node.coordIndex.setValues(0, len(index), index)
+    return node
+
+def simplifyGhost(obj, node, detail):
+    ''' Return a copy of node (the coin representation of obj) drawn with
+    the given detail: 'box', 'edges' (faces are removed) or 'decimated'
+    (see decimate). The simplified node is made once per object and 
+    copied later '''
+    key = (obj.Document.Name, obj.Name)
+    nodes = simplifiedNodes.get(key, {})
+    if detail not in nodes:
+        simple = boxNode(obj) if detail == 'box' else None
+        if not simple:
+            simple = node.copy()
+            for path in findPaths(simple, SoIndexedFaceSet):
+                faces = path.getTail()
+                parent = path.getNodeFromTail(1)
+                coords = coordinatesOf(path)
+                if detail == 'decimated' and coords:
+                    parent.replaceChild(parent.findChild(faces), 
+                            decimate(faces, coords))
+                else:
+                    parent.removeChild(faces)
+        nodes[detail] = simple
+        simplifiedNodes[key] = nodes
+    return nodes[detail].copy()
+
+def unpickable():
+    ''' Return a pick style keeping the nodes after it out of the picks
+    (ghosts are no snap targets) '''
+    style = SoPickStyle()
+    style.style.setValue(SoPickStyle.UNPICKABLE)
+    return style
+
 class multiGhostTracker(ghostTracker):
     ''' Create a ghost from a copy of the coin representation of the object 
-    (sep) according to the type (typ) of selection '''
+    (sep) according to the type (typ) of selection. 
+    The transform (trans) can be shared with other ghosts '''
     
-    def __init__(self, obj, sep, typ):
-        super().__init__(obj)
-        ## First child of ghost is SoTransform and has to be kept, second child 
-        ## is the actual container (SoSeparator) and will be replaced
-        self.children = [self.children[0]]
+    def __init__(self, obj, sep, typ, trans=None):
+        ## First child of ghost is SoTransform, second child 
+        ## is the actual container
+        self.trans = trans
+        if not self.trans:
+            self.trans = SoTransform()
+            self.trans.translation.setValue([0,0,0])
+        self.children = [self.trans, unpickable()]
         self.node = sep
-        if typ is not 'normal':
+        if typ != 'normal':
             ## Create a SoAnnotation container to put the ghost on foreground
             self.node = SoAnnotation()
             self.node.addChild(sep)
-
-            lineColor = selectionVisibility['LineColor']
-            faceColor = selectionVisibility['FaceColor']
-
-            transparency = selectionVisibility['Transparency']
-            lineTransparency = selectionVisibility['LineTransparency']
-            lineWidth = selectionVisibility['LineWidth']
-            faceLineWidth = selectionVisibility['FaceLineWidth']
-
-            search = coin.SoSearchAction()
-            search.setInterest(search.ALL )
-            search.setSearchingAll(True)
-            SoBaseKit.setSearchingChildren(True)
-
-            variations = {
-                    SoIndexedFaceSet: {
-                        'transparency': transparency,
-                        'lineWidth': faceLineWidth},
-                    SoIndexedLineSet: {
-                        'transparency': lineTransparency,
-                        'lineWidth': lineWidth},
-                    SoPointSet: {
-                        'transparency': lineTransparency,
-                        'lineWidth': lineWidth}
-                    }
-
-            for sub_ob in variations:
-                search.setType(sub_ob.getClassTypeId())
-                search.apply(sep)
-                paths = search.getPaths()
-                for path in paths:
-                    if path:
-                        parent = path.getNodeFromTail(1)
-                        for ch in parent.getChildren():
-                            if ch.isOfType(SoMaterial.getClassTypeId()):
-                                ch.diffuseColor.getValues()[0].setValue(
-                                        lineColor[typ])
-                                ch.transparency.setValue(
-                                        variations[sub_ob]['transparency'][typ])
-                                ch.emissiveColor.getValues()[0].setValue(
-                                        faceColor[typ])
-                            if ch.isOfType(SoShapeHints.getClassTypeId()):
-                                ch.vertexOrdering.setValue(1)
-                            if ch.isOfType(SoDrawStyle.getClassTypeId()):
-                                ch.lineWidth.setValue(
-                                        variations[sub_ob]['lineWidth'][typ])
-
+            styleGhost(sep, typ)
 
         self.children.append(self.node)
 
         Tracker.__init__(self,dotted=False,scolor=None,swidth=None,
                 children=self.children,name="ghostTracker")
 
-class SelectedObject:
-    ''' A class to get all the connection between selected objects and their
-    bases, additions and dependencies.'''
-
-    def __init__(self, obj, sel=[], sel_type='main', parent=None):
-        self.obj = obj
-        self.name = obj.Name
-        self.selectionType = sel_type
-        self.base = self.setBase(obj, sel)
-        self.isDependency = True if 'dependency' in self.selectionType \
-                else False
-        self.parent = parent
-        self.additions = []
-        self.dependencies = {}
-        self.populateAdditions(sel)
-        self.populateDependencies(sel)
-        self.gui = obj.ViewObject
-        self.attr = {attr : getattr(self.gui, attr) for attr in hideAttribute}
+class batchGhostTracker(ghostTracker):
+    ''' A single ghost for all the objects of a selection type (typ): 
+    their coin nodes are grouped under one transform (trans, that can be 
+    shared with other ghosts) and one container '''
+
+    def __init__(self, typ, trans=None):
+        self.trans = trans
+        if not self.trans:
+            self.trans = SoTransform()
+            self.trans.translation.setValue([0,0,0])
+        self.node = SoSeparator() if typ == 'normal' else SoAnnotation()
+        Tracker.__init__(self,dotted=False,scolor=None,swidth=None,
+                children=[self.trans, unpickable(), self.node],
+                name="batchGhostTracker")
+
+    def add(self, node):
+        self.node.addChild(node)
+
+    def remove(self, node):
+        self.node.removeChild(node)
+
+class batchGhostMember:
+    ''' The ghost of an object inside a batchGhostTracker (batch).
+    Switching it on and off adds and removes its node from the batch. 
+    Transformations are applied to the whole batch '''
+
+    def __init__(self, batch, node):
+        self.batch = batch
+        self.node = node
+        self.switch = batch.switch
+        self.visible = False
+
+    def on(self):
+        if not self.visible:
+            self.batch.add(self.node)
+            self.visible = True
+        self.batch.on()
+
+    def off(self):
+        if self.visible:
+            self.batch.remove(self.node)
+            self.visible = False
+
+    def finalize(self):
+        self.off()
+
+    def move(self, delta):
+        self.batch.move(delta)
+
+    def rotate(self, axis, angle):
+        self.batch.rotate(axis, angle)
+
+    def center(self, point):
+        self.batch.center(point)
+
+    def scale(self, delta):
+        self.batch.scale(delta)
+
+class SelectedObject(bimEdit_core.SelectedObject):
+    ''' A SelectedObject (see bimEdit_core) with the ghosts showing its
+    role in the 3D view '''
+
+    __slots__ = ('attr', 'pristine', 'ghost')
+
+    def __init__(self, obj, sel=None, sel_type='main', parent=None):
+        super().__init__(obj, sel, sel_type, parent)
+        ## View properties to restore (in hideAttribute order): dependencies
+        ## are never hidden
+        self.attr = None if self.isDependency else \
+                tuple(getattr(obj.ViewObject, attr) for attr in hideAttribute)
+        ## Ghosts are created on demand (see getGhost) from a single
+        ## pristine copy of the coin representation
+        self.pristine = None
+        self.ghost = {}
+
+    @property
+    def gui(self):
+        return self.obj.ViewObject
+
+    def originalView(self):
+        ''' Return the view properties the object had before being hidden '''
+        return dict(zip(hideAttribute, self.attr)) if self.attr else {}
+
+    def clearGhosts(self):
+        ''' Switch off and delete the ghosts (the ones deleted yet by a 
+        transformation are just forgotten) '''
+        for ghost in self.ghost.values():
+            if ghost.switch:
+                ghost.off()
+                ghost.finalize()
         self.ghost = {}
-        ## Dependencies' ghosts will not be in foreground
-        if self.isDependency:
-            self.populateGhost()
-        ## Populate caller selection list
-        if self not in sel:
-            sel.append(self)
-
-    def get_attr(self, name, attr):
-        ''' Catch properties which are used in expressions of its InList '''
-        return re.search(name + '\.(.*?)(\s|$)', attr).group(1)
-
-    def hide(self):
+
+    def hide(self, batch=None):
         ''' Hide the real object in order to not disturb the 
         (transparent) ghost visibility.
         Dependencies' ghosts overlay real objects: so there is no need to
-        hide or show the real objects '''
+        hide or show the real objects.
+        If a ViewStateBatch is given changes are collected there '''
         if not self.isDependency:
+            hiddenViews[(self.obj.Document.Name, self.name)] = \
+                    self.originalView()
             for attr in hideAttribute:
-                setattr(self.gui, attr, hideAttribute[attr])
+                if batch:
+                    batch.set(self.gui, attr, hideAttribute[attr])
+                else:
+                    setattr(self.gui, attr, hideAttribute[attr])
     
-    def show(self):
+    def show(self, batch=None):
         ''' Show the real object (usually used when ghost is off).
         Dependencies' ghosts overlay real objects: so there is no need to
-        hide or show the real objects '''
+        hide or show the real objects.
+        If a ViewStateBatch is given changes are collected there '''
         if not self.isDependency:
-            for attr in hideAttribute:
-                setattr(self.gui, attr, self.attr[attr])
-
-    def setBase(self, obj, sel):
-        ''' Create a SelectedObject for the base of the object.
-         If is a base yet, create a new one and set its parent to None 
-         to avoid infinite recursive call '''
-
-        if 'Base' in self.obj.PropertiesList and obj.Base:
-            return SelectedObject(obj.Base, sel, self.selectionType + '_base', 
-                    self)
-        elif 'base' not in self.selectionType:
-            return SelectedObject(obj, sel, self.selectionType + '_base', None)
-        else:
-            return None
-
-    def populateDependencies(self, sel):
-        for dep in self.obj.InList:
-            for pair in dep.ExpressionEngine:
-                ## if object is used in expression
-                ## (TODO: check in case of objects with same name ends)
-                if self.name + '.' in pair[1]:
-                    local_attr = self.get_attr(self.name, pair[1])
-                    if local_attr not in self.dependencies:
-                        self.dependencies[local_attr] = []
-                    ## Create a new SelectedObject for every dependency
-                    self.dependencies[local_attr].append((SelectedObject(dep,
-                        sel, self.selectionType + '_dependency'), pair[0]))
-
-    def populateAdditions(self, sel, obj=None):
-        ''' Recursive function to create a SelectedObject for every additions 
-        (and eventually for the additions of additions)'''
-        if not obj:
-            obj = self.obj
-        if 'Additions' in obj.PropertiesList and len(obj.Additions) > 0:
-            for o in obj.Additions:
-                if (o, 'addition') not in [(s.obj, s.selectionType) \
-                        for s in sel]:
-                    ## Create a new SelectedObject of type "addition" if obj 
-                    ## is not present in the selection list as "addition"
-                    self.additions.append(SelectedObject(o, sel, 'addition'))
-                    self.populateAdditions(sel, o)
+            hiddenViews.pop((self.obj.Document.Name, self.name), None)
+            for attr, value in self.originalView().items():
+                if batch:
+                    batch.set(self.gui, attr, value)
                 else:
-                    for s in sel:
-                        if s.obj == o and s.selectionType == 'addition':
-                            ## If already in selection list as "addition" put it
-                            ## in the list without creating a new SelectedObject
-                            self.additions.append(s)
-                            break
+                    setattr(self.gui, attr, value)
+
+    def getGhost(self, typ, batch=None, trans=None, crowded=False):
+        ''' Return the ghost for the selection condition typ, creating it
+        the first time it is needed. If a batchGhostTracker is given the
+        ghost is a member of it instead of a tracker on its own, otherwise
+        it can be given a shared transform (trans). Heavy objects, or all
+        the objects if crowded is True, get simplified ghosts (see 
+        ghostDetail) '''
+        if typ not in self.ghost:
+            if not self.pristine:
+                self.populateGhost()
+            detail = ghostDetail(self, typ, crowded)
+            ## Only 'normal' ghost leaves the coin nodes untouched
+            if typ == 'normal':
+                separator = self.pristine
+            elif detail == 'full':
+                separator = self.pristine.copy()
+            else:
+                separator = simplifyGhost(self.obj, self.pristine, detail)
+            if batch:
+                if typ != 'normal':
+                    styleGhost(separator, typ)
+                self.ghost[typ] = batchGhostMember(batch, separator)
+            else:
+                self.ghost[typ] = multiGhostTracker(self.obj, separator, typ,
+                        trans)
+        return self.ghost[typ]
 
+    @profiled('populateGhost')
     def populateGhost(self):
-        ''' Create a ghost for every selection condition '''
-        FreeCADGui.Selection.clearSelection()
+        ''' Take the pristine copy of the coin representation the ghosts
+        are made of (it has to be done before the object is hidden).
+        The document is never modified: objects with additions get their
+        ghost from the shape they have before the additions are fused
+        (see getShape) '''
         ob = self.obj
+        key = (ob.Document.Name, ob.Name)
+        if key in pristineNodes:
+            self.pristine = pristineNodes[key]
+            return
+        shape = None
+        if 'Additions' in ob.PropertiesList and len(ob.Additions) > 0:
+            shape = getShape(ob)
         visible = ob.ViewObject.Visibility
-        tempAdds = []
-        if not visible:
-            ## Object need to be visible in order to create the ghost
+        if not shape and not visible:
+            ## Object need to be visible in order to copy its representation
             ob.ViewObject.Visibility = True
-        if 'Additions' in ob.PropertiesList and len(ob.Additions) > 0:
-            ## Remove all the additions and take note of them: 
-            ## need to restore them later
-            tempAdds = ob.Additions
-            ob.Additions = []
-            FreeCAD.ActiveDocument.recompute()
-        for typ in ['normal', 'toEdit', 'dirDeps', 'exprDeps']:
-            ## Create a multighost for every selection condition
-            separator = self.obj.ViewObject.RootNode.copy()
-            self.ghost.update({typ: multiGhostTracker(
-                self.obj, separator, typ)})
-        ## Restore additions and visibility
-        if len(tempAdds) > 0:
-            ob.Additions += tempAdds
-        if not visible:
+        if shape:
+            self.pristine = shapeNode(shape)
+        else:
+            ## Fall back to the whole representation (additions included)
+            self.pristine = ob.ViewObject.RootNode.copy()
+        pristineNodes[key] = self.pristine
+        ## Restore visibility
+        if not shape and not visible:
             ob.ViewObject.Visibility = False
 
 
+def showProgress(text):
+    ''' Show text in the status bar (nothing happens without a main 
+    window) '''
+    if hasattr(FreeCADGui, 'getMainWindow'):
+        FreeCADGui.getMainWindow().statusBar().showMessage(text)
+
+def memoryUsage(command=None):
+    ''' Return what bimEdit keeps in memory: SelectedObjects and live 
+    ghosts of command (a BaseTransform), cached coin nodes and shapes, 
+    expression index entries, children of the scene graph and resident 
+    memory of the process (KiB, None if unknown) '''
+    usage = {}
+    if command:
+        usage['selectedObjects'] = len(command.selection)
+        usage['ghosts'] = sum(len(so.ghost) for so in command.selection) + \
+                len(command.batches)
+    usage['pristineNodes'] = len(pristineNodes)
+    usage['ownShapes'] = len(ownShapes)
+    usage['expressionIndex'] = sum(len(i.dependents) \
+            for i in expressionIndexes.values())
+    view = FreeCADGui.ActiveDocument.ActiveView if \
+            FreeCADGui.ActiveDocument else None
+    if hasattr(view, 'getSceneGraph'):
+        usage['sceneGraph'] = view.getSceneGraph().getNumChildren()
+    try:
+        with open('/proc/self/statm') as f:
+            usage['rss'] = int(f.read().split()[1]) * \
+                    os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, ValueError, AttributeError):
+        usage['rss'] = None
+    return usage
+
 class BaseTransform(Modifier):
     "The BaseTransform command definition"
 
     def __init__(self):
         Modifier.__init__(self)
         self.keys = {
-                'g': lambda x: bimMove(x),
-                'r': lambda x: bimRotate(x),
-                #'s': lambda x: bimScale(x),
+                'g': lambda x, t, n: bimMove(x, t, n),
+                'r': lambda x, t, n: bimRotate(x, t, n),
+                's': lambda x, t, n: bimScale(x, t),
                 #'m': lambda x: bimMirror(x),
                 #'t': lambda x: bimStretch(x),
                 }
+        ## Transformations that can create arrays
+        self.arrayKeys = ['g', 'r']
         self.call_sel = None
         self.call_key = None
         self.call_status = None
-        self.selection = []
         self.sel_options = sorted(selectionOption().keys())
+        self.reset()
+
+    def reset(self):
+        ''' Forget the selection of the previous run. The instance is kept
+        between runs (see bimEdit_command): the caches of the module 
+        (expression index, pristine nodes...) stay warm meanwhile '''
+        self.selection = SelectionRegistry()
+        ## Current selection type of every SelectedObject with a role
+        self.roles = {}
+        self.batches = {}
+        ## Transform shared by the ghosts of movingTypes: transformations 
+        ## preview acts on it only
+        self.ghostTrans = None
         self.sel_opt_no = 0
+        ## Ghosts waiting to be built: SelectedObject -> selection type
+        self.pending = {}
+        self.pendingTotal = 0
+        ## Every selection set has a new generation (see buildGhosts)
+        self.generation = 0
+        ## Hidden objects: object name -> SelectedObject hiding it
+        self.hidden = {}
+        ## The transformation the ghosts are handed to
+        self.transform = None
 
     def Activated(self):
         self.name = translate("draft","BaseTransform", utf8_decode=True)
         Modifier.Activated(self,self.name)
+        self.reset()
+        profiler.enabled = settings['profile']
+        profiler.reset()
         if self.ui:
             if not FreeCADGui.Selection.getSelection():
                 self.ui.selectUi()
@@ -377,6 +754,7 @@ class BaseTransform(Modifier):
             else:
                 self.proceed()
 
+    @profiled('proceed')
     def proceed(self):
         if self.call_sel:
             self.view.removeEventCallback("SoEvent",self.call_sel)
@@ -387,79 +765,161 @@ class BaseTransform(Modifier):
         ## self.actual_selection is what the user clicked
         ## self.selection is the actual selection extended to bases, 
         ## additions and dependencies
-        self.actual_selection = [SelectedObject(o, self.selection) \
-                for o in self.sel]
-        ## Create the ghosts for selection: 
-        ## 2d object are done on last to keep them in foreground
-        for o in self.selection:
-            if 'Part2DObject' not in o.obj.TypeId and not o.isDependency :
-                o.populateGhost()
-        for o in self.selection:
-            if 'Part2DObject' in o.obj.TypeId and not o.isDependency:
-                o.populateGhost()
+        self.actual_selection = [self.selection.get(o, 'main') or \
+                SelectedObject(o, self.selection) for o in self.sel]
+        ## Partitions of the selection are computed once
+        self.possible_selections = selectionOption(self.selection)
+        ## Ghosts are created when a selection set needs them: 
+        ## clear the selection to not copy its highlight
         FreeCADGui.Selection.clearSelection()
+        self.ghostTrans = SoTransform()
+        if settings['batchGhosts']:
+            self.batches = {typ: batchGhostTracker(typ, 
+                self.ghostTrans if typ in movingTypes else None) \
+                        for typ in batchOrder}
 
         self.getSelectionSet()
         self.call_key = self.view.addEventCallback(
             "SoKeyboardEvent", self.key_switch)
 
+    @profiled('getSelectionSet')
     def getSelectionSet(self):
         ''' Get the selection set based on available options
-        (see selectionOption())'''
-        for so in self.selection:
-            for gt in so.ghost:
-                if so.ghost[gt].switch:
-                    so.ghost[gt].off()
+        (see selectionOption()). Only the objects whose role changes from
+        the previous selection set get their ghosts and visibility updated.
+        Ghosts are built progressively (see buildGhosts) '''
         no  = self.sel_opt_no
         self.sel_opt_no = (self.sel_opt_no + 1) % len(self.sel_options)
-        self.possible_selections = selectionOption(self.selection)
         temp_sel = self.possible_selections[self.sel_options[no]]
         FreeCAD.Console.PrintMessage('\n' + temp_sel['print'] + '\n')
         self.chosen_selection = {k: temp_sel[k] for k in temp_sel if k != 'print'}
         #print(self.chosen_selection)
-        for outer, st in enumerate(self.chosen_selection):
-            for inner, so in enumerate(self.chosen_selection[st]):
-                ## Hide objects, show ghosts
-                so.hide()
-                so.ghost[st].on()
+        roles = {so: st for st in self.chosen_selection \
+                for so in self.chosen_selection[st]}
+        ## Ghosts not built yet by the previous selection set are changed too
+        changed = sorted([(st, so) for so, st in roles.items() \
+                if self.roles.get(so) != st or so in self.pending], 
+                key=lambda c: (ghostPriority.index(c[0]), ghostOrder(c[1])))
+        for so, st in self.roles.items():
+            if roles.get(so) != st and st in so.ghost:
+                so.ghost[st].off()
+        ## Objects are hidden while any of their SelectedObject has a role
+        ## (see buildGhosts)
+        to_hide = {so.name for so in roles if not so.isDependency}
+        batch = ViewStateBatch()
+        for name in list(self.hidden):
+            if name not in to_hide:
+                self.hidden.pop(name).show(batch)
+        batch.apply()
+        self.roles = roles
+        self.pending = {so: st for st, so in changed}
+        self.pendingTotal = len(self.pending)
+        ## Slices scheduled by previous selection sets are dropped
+        self.generation += 1
+        self.buildGhosts(self.generation)
+
+    @profiled('buildGhosts')
+    def buildGhosts(self, generation=None, complete=False):
+        ''' Build and show the pending ghosts (most important first, see
+        ghostPriority), hiding their objects. Unless complete is True it stops
+        after settings['ghostSlice'] milliseconds and schedules the rest, so
+        that the Gui keeps responding meanwhile. The rest gets a timer of 
+        its own: todo.delay called from a task of todo would run it in the
+        same turn of the event loop '''
+        if generation is not None and generation != self.generation:
+            return
+        limit = 0 if complete else settings['ghostSlice'] / 1000.
+        crowded = len(self.selection.names) > settings['lodObjects']
+        start = time.perf_counter()
+        batch = ViewStateBatch()
+        while self.pending:
+            so = next(iter(self.pending))
+            st = self.pending.pop(so)
+            so.getGhost(st, self.batches.get(st), 
+                    self.ghostTrans if st in movingTypes else None,
+                    crowded).on()
+            ## The pristine copy is taken before its object is hidden
+            if not so.isDependency and so.name not in self.hidden:
+                so.hide(batch)
+                self.hidden[so.name] = so
+            if limit and time.perf_counter() - start > limit:
+                break
+        batch.apply()
+        if self.pending:
+            showProgress(translate("draft", "Building ghosts") + \
+                    ' {}/{}'.format(self.pendingTotal - len(self.pending),
+                        self.pendingTotal))
+            generation = self.generation
+            QtCore.QTimer.singleShot(0, lambda: self.buildGhosts(generation))
+        else:
+            showProgress('')
 
     def key_switch(self,info):
         ''' According to the key pressed do:
         - Ctrl + Space -> Switch selection type
         - q -> Restore visibility and quit the command
-        - g or r or ... -> Launch the tranformation '''
+        - g or r or ... -> Launch the tranformation
+        - Shift + g or r -> Launch the transformation as an array '''
 
         if info['Type'] == 'SoKeyboardEvent' and info['Key'] == 'SPACE' \
                 and info['State'] == 'UP' and info['CtrlDown'] == True:
                     print(info['Key'], 'pressed!')
                     self.getSelectionSet()
-        elif info['Type'] == 'SoKeyboardEvent' and info['Key'] == 'q' \
-                and info['State'] == 'UP':
+        elif info['Type'] == 'SoKeyboardEvent' and \
+                info['Key'] in ('q', 'Q', 'ESCAPE') and info['State'] == 'UP':
                     print(info['Key'], 'pressed!')
                     self.stopHightlight()
-        elif info['Type'] == 'SoKeyboardEvent' and info['Key'] in self.keys \
-                and info['State'] == 'UP':
+        elif info['Type'] == 'SoKeyboardEvent' and \
+                info['Key'].lower() in self.keys and info['State'] == 'UP':
+                    ## With Shift held the key is the upper case letter
+                    key = info['Key'].lower()
                     print(info['Key'], 'pressed!')
-                    self.getTransform(info['Key'])
+                    self.getTransform(key, info['ShiftDown'] and \
+                            key in self.arrayKeys)
 
     def stopHightlight(self):
         ''' Delete ghosts, restore visibility of objects and 
         quit the command '''
         FreeCADGui.Selection.clearSelection()
-        for so in self.selection:
-            for gt in so.ghost:
-                if so.ghost[gt].switch:
-                    so.ghost[gt].off()
-            so.show()
-            FreeCAD.ActiveDocument.recompute()
-        self.view.removeEventCallback("SoKeyboardEvent", self.call_key)
-
-    def getTransform(self, key):
-        ''' Create the transformation and activate it '''
+        recomputer.request([so.obj for so in self.selection])
+        self.finish()
 
+    def teardown(self):
+        ''' Delete ghosts and batches and restore visibility of objects '''
+        batch = ViewStateBatch()
+        for so in self.selection:
+            so.clearGhosts()
+            so.show(batch)
+        batch.apply()
+        for ghost in self.batches.values():
+            if ghost.switch:
+                ghost.off()
+                ghost.finalize()
+        self.batches = {}
+        self.roles = {}
+        self.pending = {}
+        self.hidden = {}
+        self.generation += 1
+        showProgress('')
+
+    def getTransform(self, key, array=False):
+        ''' Create the transformation and activate it.
+        If array is True ask for the number of copies to create '''
+
+        count = 1
+        if array:
+            count, ok = QtGui.QInputDialog.getInt(None, 
+                    translate("draft", "Array"),
+                    translate("draft", "Number of copies:"), 2, 2, 10000)
+            if not ok:
+                return
         self.view.removeEventCallback("SoKeyboardEvent", self.call_key)
+        self.call_key = None
+        ## The transformation needs all the ghosts
+        self.buildGhosts(complete=True)
         #print(self.chosen_selection)
-        self.transform = self.keys[key](self.chosen_selection)
+        self.transform = self.keys[key](self.chosen_selection, 
+                self.ghostTrans, count)
         self.transform.Activated()
         self.call_status = self.view.addEventCallback("SoEvent", self.status)
 
@@ -469,22 +929,43 @@ class BaseTransform(Modifier):
         if not FreeCAD.activeDraftCommand:
             ## Transformation completed
             self.view.removeEventCallback("SoEvent", self.call_status)
+            self.call_status = None
             print('finished')
             FreeCADGui.Selection.clearSelection()
-            for so in self.selection:
-                ## Delete ghosts and restore visibility of objects
-                so.ghost = {}
-                so.show()
-            FreeCAD.activeDocument().recompute()
+            self.transform = None
+            self.teardown()
+            recomputer.flush()
+            self.report()
+
+    def report(self):
+        ''' Print (and save) the timing of the command phases '''
+        if profiler.enabled:
+            profiler.report(self.name, settings['profileFile'])
+            profiler.enabled = False
+        if settings['memoryReport']:
+            FreeCAD.Console.PrintMessage(self.name + ' memory: ' + \
+                    ', '.join('{} {}'.format(k, v) for k, v in \
+                        memoryUsage(self).items()) + '\n')
 
     def finish(self):
-        ## TODO Make sure it finishes when push "Close" or escape
-        FreeCAD.activeDocument().recompute()
+        ''' Close the command (quit, Escape, Close button or another Draft
+        command starting). Ghosts are deleted unless a transformation has
+        taken them over: status deletes them when it ends '''
+        if self.call_sel:
+            self.view.removeEventCallback("SoEvent", self.call_sel)
+        if self.call_key:
+            self.view.removeEventCallback("SoKeyboardEvent", self.call_key)
         self.call_sel = None
         self.call_key = None
-        self.call_status = None
+        if not self.transform:
+            self.teardown()
+            self.report()
+        recomputer.flush()
         Modifier.finish(self)
 
 
-bt = BaseTransform()
-bt.Activated()
+if __name__ == '__main__':
+    ## Run as a macro: the command registered by bimEdit_command is used, so
+    ## that next runs find it ready
+    import bimEdit_command
+    bimEdit_command.run()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#*******************************************************************************
+#*  (c) Marco Ferrara - https://github.com/marzof/ - 2019                      *
+#*                                                                             *
+#*  This program is free software: you can redistribute it and/or modify       *
+#*  it under the terms of the GNU General Public License as published by       *
+#*  the Free Software Foundation, either version 3 of the License, or          *
+#*  (at your option) any later version.                                        *
+#*                                                                             *
+#*  This program is distributed in the hope that it will be useful,            *
+#*  but WITHOUT ANY WARRANTY; without even the implied warranty of             *
+#*  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              *
+#*  GNU General Public License for more details                                *
+#*                                                                             *
+#*  You should have received a copy of the GNU General Public License          *
+#*  along with this program.  If not, see <https://www.gnu.org/licenses/>.     *
+#*                                                                             *
+#*******************************************************************************
+
+## Benchmarks of the bimEdit hot paths, run headless on the stand-in
+## modules of bimEdit_standin (no FreeCAD or display needed):
+##
+##   python3 bimEdit_bench.py --objects 200 --depth 2 --fanout 3
+##
+## A synthetic document is made of walls: every selected wall has a base,
+## a chain of depth additions (walls with their own base) and fanout windows
+## using it in their expressions. Time and peak memory (tracemalloc) are
+## reported for every phase: expression index, graph building, ghosts,
+## cold and warm command start, selection cycling, a session of runs of the
+## command, snapping, replica, move/rotate/scale commits and arrays (asked
+## for with Shift, see --copies). Unselected walls (see --static) are the
+## snap targets. Expression parsing and indexing are checked first (see
+## checkExpressions).
+
+import sys, os, time, gc, json, argparse, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bimEdit_standin as standin
+standin.install()
+
+import FreeCAD, FreeCADGui
+import bimEdit, bimEdit_core
+from bimEdit_core import compactNames, subgraphOf
+from bimEdit_overrides import bimMove, batchArray, staticSnapIndex, \
+        snapPoint
+
+def makeDocument(objects, depth, fanout, triangles, static=0):
+    ''' Create the synthetic document and return it with the walls
+    to select (static walls are left out) '''
+    doc = FreeCAD.newDocument('bench')
+
+    def wall(level):
+        base = doc.addObject('Part::Part2DObjectPython', 'Wire', triangles)
+        obj = doc.addObject('Part::FeaturePython', 'Wall', triangles)
+        obj.Proxy = standin.archProxy('Wall')
+        obj.addProperty('Length', 4000.)
+        obj.addProperty('Width', 200.)
+        obj.addProperty('Height', 3000.)
+        obj.addProperty('Base', base)
+        obj.addProperty('Additions',
+                [wall(level + 1)] if level < depth else [])
+        for i in range(fanout):
+            win = doc.addObject('Part::FeaturePython', 'Window', triangles)
+            win.Proxy = standin.archProxy('Window')
+            win.addProperty('Hosts', [obj])
+            win.setExpression('Placement.Base.z', obj.Name + '.Height / 2')
+        return obj
+
+    walls = [wall(0) for i in range(objects)]
+    for i in range(static):
+        wall(depth)
+    return doc, walls
+
+def measure(results, phase, func):
+    ''' Run func and append to results its time and peak memory '''
+    gc.collect()
+    start_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    func()
+    standin.processEvents()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - start_mem
+    results.append({'phase': phase, 'time': elapsed, 'peak': peak})
+
+def reset():
+    ''' Drop the documents and the caches of the previous run '''
+    for name in list(standin.documents):
+        standin.closeDocument(name)
+    ## Caches of bimEdit forget the closed documents (see DocumentCache)
+    FreeCAD.activeDraftCommand = None
+    FreeCAD.Console.messages.clear()
+    FreeCADGui.Selection.clearSelection()
+    standin.processEvents()
+
+def checkExpressions():
+    ''' Check parseReferences and ExpressionIndex on a small document:
+    names prefix of other names, references by label, to other documents
+    and several references in one expression. Raise RuntimeError on the 
+    first mismatch '''
+    cases = [
+        ('Wall1.Length + Wall12.Length',
+            (('', 'Wall1', 'Length'), ('', 'Wall12', 'Length'))),
+        ('<<My wall>>.Height / 2', (('', '<<My wall>>', 'Height'),)),
+        ('Doc#Wall1.Placement.Base.z',
+            (('Doc', 'Wall1', 'Placement.Base.z'),)),
+        ('Wall1.Width * 2 + Wall1.Height - 1e3',
+            (('', 'Wall1', 'Width'), ('', 'Wall1', 'Height'))),
+    ]
+    for expr, refs in cases:
+        found = bimEdit_core.parseReferences(expr)
+        if found != refs:
+            raise RuntimeError('{!r} refers to {}, not {}'.format(expr,
+                found, refs))
+    doc = FreeCAD.newDocument('check')
+    for name in ('Wall1', 'Wall12', 'Wall'):
+        doc.addObject('Part::FeaturePython', name)
+    doc.getObject('Wall').Label = 'My wall'
+    win = doc.addObject('Part::FeaturePython', 'Window')
+    win.setExpression('Width', 'Wall1.Width + Wall1.Length')
+    win.setExpression('Height', 'check#Wall1.Height')
+    win.setExpression('Placement.Base.z',
+            'Wall12.Height / 2 + <<My wall>>.Width + Other#Wall12.Length')
+    expected = {
+        'Wall1': [('Width', 'Width'), ('Width', 'Length'),
+            ('Height', 'Height')],
+        'Wall12': [('Placement.Base.z', 'Height')],
+        'Wall': [('Placement.Base.z', 'Width')],
+    }
+    try:
+        index = bimEdit_core.getExpressionIndex(doc)
+        for i in range(2):
+            for name, deps in expected.items():
+                found = [(prop, attr) for dep, prop, attr \
+                        in index.getDependents(doc.getObject(name))]
+                if found != deps:
+                    raise RuntimeError('{} has dependents {}, not {}'.format(
+                        name, found, deps))
+            ## The index follows the changes of expressions
+            win.setExpression('Width', '1000')
+            win.setExpression('Height', 'Wall12.Height')
+            expected['Wall1'] = []
+            expected['Wall12'].append(('Height', 'Height'))
+    finally:
+        standin.closeDocument('check')
+
+def run(args):
+    ''' Run every phase once and return the results '''
+    reset()
+    results = []
+    doc, walls = makeDocument(args.objects, args.depth, args.fanout,
+            args.triangles, args.static)
+    state = {}
+
+    def graph():
+        state['sel'] = bimEdit.SelectionRegistry()
+        for w in walls:
+            bimEdit.SelectedObject(w, state['sel'])
+
+    def ghosts():
+        for so in state['sel']:
+            so.populateGhost()
+
+    def proceed():
+        bimEdit.pristineNodes.clear()
+        FreeCADGui.Selection.selected = list(walls)
+        state['bt'] = bt = bimEdit.BaseTransform()
+        bt.Activated()
+
+    def warm():
+        ''' Run again the same command (see bimEdit_command) on the same
+        selection: caches are warm '''
+        FreeCADGui.Selection.selected = list(walls)
+        state['bt'].Activated()
+
+    def session():
+        ''' Run the command and quit it (see --runs) '''
+        for i in range(args.runs):
+            FreeCADGui.Selection.selected = list(walls)
+            state['bt'].Activated()
+            state['bt'].stopHightlight()
+            standin.processEvents()
+
+    def cycle():
+        bt = state['bt']
+        for i in range(len(bt.sel_options)):
+            bt.getSelectionSet()
+
+    def snapIndex():
+        state['snap'] = snap = bimMove(state['bt'].chosen_selection, None)
+        snap.view = standin.get3DView()
+        snap.snapIndex = staticSnapIndex(snap.sel_dict)
+
+    def snapEvents():
+        ''' Move the cursor along the document (see --events) '''
+        snap = state['snap']
+        hits = 0
+        length = 500. * len(doc.Objects)
+        for i in range(args.events):
+            x = length * i / args.events
+            info = snapPoint(snap, {'Type': 'SoLocation2Event',
+                'Position': (x, 100.)})[2]
+            hits += bool(info)
+        state['hits'] = hits
+
+    def replicas():
+        bt = state['bt']
+        to_edit = bt.possible_selections['3_obj_addition_base']['toEdit']
+        batchArray(compactNames(list(subgraphOf(to_edit))),
+            compactNames(list(dict.fromkeys(s.name for s in to_edit))), 1)
+
+    def transform(key, apply, shift=False):
+        ''' Start the transformation of key (Shift asks for an array) on 
+        the objects and additions of the command and close it the way 
+        BaseTransform.status does '''
+        bt = state['bt']
+        bt.sel_opt_no = bt.sel_options.index('2_obj_addition')
+        bt.getSelectionSet()
+        bt.key_switch(standin.keyEvent(key, shift=shift))
+        cmd = bt.transform
+        apply(cmd)
+        cmd.finish()
+        standin.processEvents()
+        bt.status({})
+
+    def move(shift=False):
+        transform('g', lambda cmd: cmd.move(FreeCAD.Vector(1000, 0, 0)),
+                shift)
+
+    def rotate(shift=False):
+        def rot(cmd):
+            cmd.center = FreeCAD.Vector(0, 0, 0)
+            cmd.rot(0.5)
+        transform('r', rot, shift)
+
+    def scale():
+        def sc(cmd):
+            cmd.node = [FreeCAD.Vector(0, 0, 0)]
+            cmd.scale(2, 2, 2, False, 1)
+        transform('s', sc)
+
+    measure(results, 'index', lambda: bimEdit_core.getExpressionIndex(doc))
+    measure(results, 'graph', graph)
+    measure(results, 'populateGhost', ghosts)
+    measure(results, 'proceed', proceed)
+    state['bt'].stopHightlight()
+    measure(results, 'proceed (warm)', warm)
+    measure(results, 'getSelectionSet', cycle)
+    state['bt'].stopHightlight()
+    measure(results, 'session', session)
+    state['usage'] = bimEdit.memoryUsage(state['bt'])
+    proceed()
+    measure(results, 'snap index', snapIndex)
+    measure(results, 'snap events', snapEvents)
+    measure(results, 'replica', replicas)
+    measure(results, 'move commit', move)
+    proceed()
+    measure(results, 'rotate commit', rotate)
+    proceed()
+    measure(results, 'scale commit', scale)
+    proceed()
+    measure(results, 'array move', lambda: move(True))
+    proceed()
+    measure(results, 'array rotate', lambda: rotate(True))
+    errors = [m for m in FreeCAD.Console.messages if m.startswith('[Draft')]
+    if errors:
+        raise RuntimeError(''.join(errors))
+    results.append({'phase': 'document', 'objects': len(doc.Objects),
+        'selected': len(state['sel']), 'recomputed': doc.recomputed,
+        'sceneGraph': state['usage']['sceneGraph'],
+        'snapTargets': len(state['snap'].snapIndex), 'snapped': state['hits'],
+        'finalSceneGraph': bimEdit.memoryUsage()['sceneGraph']})
+    return results
+
+def report(runs):
+    ''' Print the best time and the largest peak of every phase '''
+    phases = [r['phase'] for r in runs[0] if 'time' in r]
+    info = runs[0][-1]
+    print('{} objects in document, {} in selection graph, {} recomputed'\
+            .format(info['objects'], info['selected'], info['recomputed']))
+    print('scene graph nodes: {} after the session, {} at the end'.format(
+        info['sceneGraph'], info['finalSceneGraph']))
+    print('{} snap targets, {} events snapped'.format(info['snapTargets'],
+        info['snapped']))
+    print('{:<18}{:>12}{:>14}'.format('phase', 'time (ms)', 'peak (KiB)'))
+    for i, phase in enumerate(phases):
+        best = min(r[i]['time'] for r in runs)
+        peak = max(r[i]['peak'] for r in runs)
+        print('{:<18}{:>12.2f}{:>14.1f}'.format(phase, 1000 * best,
+            peak / 1024))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=
+            'Benchmark the bimEdit selection and ghost hot paths')
+    parser.add_argument('--objects', type=int, default=100,
+            help='selected walls (default 100)')
+    parser.add_argument('--depth', type=int, default=1,
+            help='chain of additions of every wall (default 1)')
+    parser.add_argument('--fanout', type=int, default=2,
+            help='objects using every wall in expressions (default 2)')
+    parser.add_argument('--triangles', type=int, default=48,
+            help='triangles of every coin representation (default 48)')
+    parser.add_argument('--static', type=int, default=100,
+            help='walls left out of the selection (default 100)')
+    parser.add_argument('--events', type=int, default=1000,
+            help='mouse movements in the snap events phase (default 1000)')
+    parser.add_argument('--copies', type=int, default=3,
+            help='copies made by the array phases (default 3)')
+    parser.add_argument('--runs', type=int, default=10,
+            help='runs of the command in the session phase (default 10)')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='runs to take the best time of (default 3)')
+    parser.add_argument('--lod-mode', choices=['full', 'box', 'edges',
+            'decimated'], help='drawing of heavy ghosts (see bimEdit settings)')
+    parser.add_argument('--lod-triangles', type=int,
+            help='triangles above which ghosts are simplified')
+    parser.add_argument('--json', help='write the raw results to this file')
+    args = parser.parse_args(argv)
+    standin.QInputDialog.count = args.copies
+    if args.lod_mode:
+        bimEdit.settings['lodMode'] = args.lod_mode
+    if args.lod_triangles is not None:
+        bimEdit.settings['lodTriangles'] = args.lod_triangles
+
+    checkExpressions()
+    tracemalloc.start()
+    runs = [run(args) for i in range(args.repeat)]
+    tracemalloc.stop()
+    report(runs)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'runs': runs}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#*******************************************************************************
+#*  (c) Marco Ferrara - https://github.com/marzof/ - 2019                      *
+#*                                                                             *
+#*  This program is free software: you can redistribute it and/or modify       *
+#*  it under the terms of the GNU General Public License as published by       *
+#*  the Free Software Foundation, either version 3 of the License, or          *
+#*  (at your option) any later version.                                        *
+#*                                                                             *
+#*  This program is distributed in the hope that it will be useful,            *
+#*  but WITHOUT ANY WARRANTY; without even the implied warranty of             *
+#*  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              *
+#*  GNU General Public License for more details                                *
+#*                                                                             *
+#*  You should have received a copy of the GNU General Public License          *
+#*  along with this program.  If not, see <https://www.gnu.org/licenses/>.     *
+#*                                                                             *
+#*******************************************************************************
+
+## Registration of bimEdit as a persistent FreeCAD command.
+##
+## This module is light: bimEdit (with Draft and coin) is imported the first 
+## time the command runs, and the same BaseTransform is reused by the next
+## runs, finding the expression index and the pristine ghost nodes ready.
+## Register the command at startup (see InitGui.py) or run it from a macro
+## (see bimEdit.FCMacro): in both cases it is registered only once.
+
+import FreeCAD, FreeCADGui
+
+commandName = 'bimEdit_BaseTransform'
+
+class BaseTransformCommand:
+    ''' The Gui command launching bimEdit.BaseTransform '''
+
+    def __init__(self):
+        self.command = None
+
+    def GetResources(self):
+        return {'Pixmap': 'Draft_Move',
+                'MenuText': 'BaseTransform',
+                'ToolTip': 'Move, rotate or scale objects together with ' + \
+                        'their bases, additions and dependencies'}
+
+    def IsActive(self):
+        return FreeCAD.ActiveDocument is not None
+
+    def Activated(self):
+        if not self.command:
+            import bimEdit
+            self.command = bimEdit.BaseTransform()
+        self.command.Activated()
+
+def register():
+    ''' Add the command to FreeCAD unless it has been added yet '''
+    if commandName not in FreeCADGui.listCommands():
+        FreeCADGui.addCommand(commandName, BaseTransformCommand())
+
+def run():
+    ''' Register the command if needed and launch it '''
+    register()
+    FreeCADGui.runCommand(commandName)
@@ -0,0 +1,719 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#*******************************************************************************
+#*  (c) Marco Ferrara - https://github.com/marzof/ - 2019                      *
+#*                                                                             *
+#*  This program is free software: you can redistribute it and/or modify       *
+#*  it under the terms of the GNU General Public License as published by       *
+#*  the Free Software Foundation, either version 3 of the License, or          *
+#*  (at your option) any later version.                                        *
+#*                                                                             *
+#*  This program is distributed in the hope that it will be useful,            *
+#*  but WITHOUT ANY WARRANTY; without even the implied warranty of             *
+#*  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              *
+#*  GNU General Public License for more details                                *
+#*                                                                             *
+#*  You should have received a copy of the GNU General Public License          *
+#*  along with this program.  If not, see <https://www.gnu.org/licenses/>.     *
+#*                                                                             *
+#*******************************************************************************
+
+## GUI-free core of bimEdit: it resolves what moves with what (bases,
+## additions and expression dependencies of the selected objects) and
+## transforms or copies objects in batch. It needs neither coin nor Qt, so it
+## can be used by batch scripts running in FreeCADCmd:
+##
+##   import bimEdit_core
+##   sel = bimEdit_core.SelectionRegistry()
+##   for obj in objects:
+##       bimEdit_core.SelectedObject(obj, sel)
+##   toEdit = bimEdit_core.selectionOption(sel)['2_obj_addition']['toEdit']
+##   bimEdit_core.batchMove(bimEdit_core.compactNames(
+##       [so.name for so in toEdit]), FreeCAD.Vector(1000,0,0))
+
+import FreeCAD, re, time, json, math, functools, collections
+
+### Profiling and recomputes ###
+
+class Profiler:
+    ''' Count and duration of named spans (the phases of a command).
+    Nothing is recorded unless enabled (see settings['profile'] in bimEdit) '''
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = {} ## Span name -> [count, total time, longest time]
+
+    def reset(self):
+        self.spans = {}
+
+    def record(self, name, duration):
+        span = self.spans.setdefault(name, [0, 0., 0.])
+        span[0] += 1
+        span[1] += duration
+        span[2] = max(span[2], duration)
+
+    def report(self, name, path=None):
+        ''' Print a summary of the spans to the console and, if path is 
+        given, write them to a JSON file '''
+        if not self.spans:
+            return
+        lines = ['{} timing (ms):\n'.format(name)]
+        for span, (count, total, longest) in sorted(self.spans.items(),
+                key=lambda s: -s[1][1]):
+            lines.append('  {:<16} {:>6} calls  total {:>9.1f}  '.format(
+                span, count, 1000 * total) + \
+                'mean {:>8.2f}  max {:>8.2f}\n'.format(
+                    1000 * total / count, 1000 * longest))
+        FreeCAD.Console.PrintMessage(''.join(lines))
+        if path:
+            with open(path, 'w') as f:
+                json.dump({'command': name, 'time': time.time(),
+                    'spans': {span: {'count': c, 'total': t, 'max': m} \
+                        for span, (c, t, m) in self.spans.items()}}, 
+                    f, indent=2)
+
+profiler = Profiler()
+
+def profiled(name):
+    ''' Decorator recording the calls of a function as span name of
+    profiler '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+class RecomputeScheduler:
+    ''' Collect the objects needing a recompute during a command phase and
+    recompute them, together with the objects depending on them, at once '''
+
+    def __init__(self):
+        self.dirty = {} ## Document name -> names of objects to recompute
+
+    def request(self, objs):
+        ''' Take note of objs: they will be recomputed by next flush '''
+        for o in objs:
+            self.dirty.setdefault(o.Document.Name, set()).add(o.Name)
+
+    def downstream(self, objs):
+        ''' Return objs and all the objects depending on them '''
+        closure = {o.Name: o for o in objs}
+        queue = list(objs)
+        while queue:
+            for dep in queue.pop().InList:
+                if dep.Name not in closure:
+                    closure[dep.Name] = dep
+                    queue.append(dep)
+        return list(closure.values())
+
+    def flush(self):
+        ''' Recompute the requested objects and their dependencies '''
+        dirty, self.dirty = self.dirty, {}
+        for doc_name in dirty:
+            if doc_name not in FreeCAD.listDocuments():
+                continue
+            doc = FreeCAD.getDocument(doc_name)
+            objs = [doc.getObject(n) for n in dirty[doc_name]]
+            objs = self.downstream([o for o in objs if o])
+            if not objs:
+                continue
+            self.recompute(doc, objs)
+
+    @profiled('recompute')
+    def recompute(self, doc, objs):
+        try:
+            doc.recompute(objs)
+        except TypeError:
+            ## Recompute of selected objects needs FreeCAD 0.19
+            doc.recompute()
+
+recomputer = RecomputeScheduler()
+
+### Selection graph ###
+
+pickSelection = lambda sel, sel_type: \
+        sel.ofType(sel_type) if isinstance(sel, SelectionRegistry) \
+        else [o for o in sel if o.selectionType == sel_type]
+
+def selectionOption(sel=[]):
+    ''' Entities are collected as four lists: 
+     - normal (nothing happens to them)
+     - to edit (actual editing objects), 
+     - directed dependencies (objects based on selection),
+     - expressions dependencies (dependencies called by expressions) '''
+
+    return {
+        '0_obj': {
+            'normal': pickSelection(sel, 'addition') + \
+                    pickSelection(sel, 'main_base'),
+            'toEdit': pickSelection(sel, 'main'),
+            'dirDeps': [],
+            'exprDeps': pickSelection(sel, 'main_dependency'),
+            'print' : 'The OBJECTS you clicked will be edited.\n' + \
+                    'Eventually bases and additions will not be affected. ' + \
+                    'Copies will point to the same bases'
+            },
+        '1_obj_base': {
+            'normal': pickSelection(sel, 'addition_base') + \
+                    pickSelection(sel, 'main_dependency') + \
+                    pickSelection(sel, 'addition'),
+            'toEdit': pickSelection(sel, 'main_base'),
+            'dirDeps': pickSelection(sel, 'main'),
+            'exprDeps': pickSelection(sel, 'main_base_dependency'),
+            'print' : 'The BASES of the OBJECTS you clicked will be edited.' + \
+                    '\nDirected dependencies, like the objects that are ' + \
+                    'based on them, will be affected. Copying will create ' + \
+                    'new bases and new objects based on them'
+            },
+        '2_obj_addition': {
+            'normal': pickSelection(sel, 'addition_base') + \
+                    pickSelection(sel, 'main_base'),
+            'toEdit': pickSelection(sel, 'main') + \
+                    pickSelection(sel, 'addition'),
+            'dirDeps': [],
+            'exprDeps': pickSelection(sel, 'main_dependency') + \
+                    pickSelection(sel, 'addition_dependency'),
+            'print' : 'The OBJECTS you clicked and their ADDITIONS will ' + \
+                    'be edited.\nEventually bases will not be affected. ' + \
+                    'Copies will point to the same bases'
+            },
+        '3_obj_addition_base': {
+            'normal': pickSelection(sel, 'main_dependency'),
+            'toEdit': pickSelection(sel, 'main_base') + \
+                    pickSelection(sel, 'addition_base'),
+            'dirDeps': pickSelection(sel, 'main') + \
+                    pickSelection(sel, 'addition'),
+            'exprDeps': pickSelection(sel, 'main_base_dependency') + \
+                    pickSelection(sel, 'addition_base_dependency'),
+            'print' : 'The BASES of the OBJECTS you clicked and ' + \
+                    'their ADDITIONS will be edited.\n' + \
+                    'Directed dependencies, like the objects that are ' + \
+                    'based on them, will be affected. Copying will create ' + \
+                    'new bases and new objects based on them. ' + \
+                    'Relations between additions will be maintained'
+            }
+    }
+
+## Tokens of FreeCAD expressions: <<quoted>> labels or strings, numbers,
+## identifiers and single characters (operators, dots, document separator #)
+expressionToken = re.compile(r'''
+        (?P<quoted><<.*?>>)
+      | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<ident>[^\W\d]\w*)
+      | (?P<char>\S)''', re.VERBOSE)
+
+@functools.lru_cache(maxsize=4096)
+def parseReferences(expr):
+    ''' Return every object reference of expression expr as a tuple of
+    (document, object, property path) triples: Wall.Placement.Base.z gives 
+    ('', 'Wall', 'Placement.Base.z'). Objects referred by label keep their
+    quotes (<<My wall>>) and document is empty unless given (Doc#Wall.Length).
+    Results are cached by expression, that is usually shared by many 
+    objects '''
+    tokens = [(m.lastgroup, m.group()) for m in expressionToken.finditer(expr)]
+    refs = []
+    i = 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        ## A reference starts with an object not following a dot
+        if kind not in ('ident', 'quoted') or \
+                (i and tokens[i - 1] == ('char', '.')):
+            i += 1
+            continue
+        doc = ''
+        if tokens[i + 1:i + 2] == [('char', '#')] and i + 2 < len(tokens):
+            doc, i = value.strip('<>'), i + 2
+            kind, value = tokens[i]
+        path = []
+        j = i + 1
+        while tokens[j:j + 1] == [('char', '.')] and j + 1 < len(tokens) \
+                and tokens[j + 1][0] == 'ident':
+            path.append(tokens[j + 1][1])
+            j += 2
+        if path:
+            refs.append((doc, value, '.'.join(path)))
+        i = j
+    return tuple(refs)
+
+class ExpressionIndex:
+    ''' Reverse index of the expressions of a document: for every object
+    it collects the (dependent, property, attribute) triples of the expressions
+    that refer to it. It is built once per document and kept current by
+    a document observer '''
+
+    def __init__(self, doc):
+        self.doc = doc
+        ## Name of referenced object -> dependent name -> 
+        ## {(dependent name, property, attribute): None} (insertion ordered
+        ## sets: adding and removing entries doesn't scan the others)
+        self.dependents = {}
+        ## Name of dependent object -> names of the objects it refers to
+        self.references = {}
+        for obj in doc.Objects:
+            self.indexObject(obj)
+        FreeCAD.addDocumentObserver(self)
+
+    def indexObject(self, dep):
+        ''' Add to the index the expressions of dep '''
+        outList = [o for o in dep.OutList if o.Document == self.doc]
+        if not outList:
+            return
+        ## Objects can be referred by name or by label
+        targets = {o.Name: o.Name for o in outList}
+        targets.update({'<<' + o.Label + '>>': o.Name for o in outList})
+        for prop, expr in dep.ExpressionEngine:
+            for doc, obj, path in parseReferences(expr):
+                name = targets.get(obj)
+                if not name or doc not in ('', self.doc.Name, 
+                        self.doc.Label):
+                    continue
+                self.dependents.setdefault(name, {}).setdefault(dep.Name, 
+                        {})[(dep.Name, prop, path)] = None
+                self.references.setdefault(dep.Name, set()).add(name)
+
+    def unindexObject(self, name):
+        ''' Remove from the index the expressions of object name '''
+        for target in self.references.pop(name, ()):
+            if target not in self.dependents:
+                ## Target has been deleted yet
+                continue
+            self.dependents[target].pop(name, None)
+            if not self.dependents[target]:
+                del self.dependents[target]
+
+    def getDependents(self, obj):
+        ''' Return the (dependent, property, attribute) triples of the
+        expressions that refer to obj '''
+        return [(self.doc.getObject(dep), prop, attr) \
+                for entries in self.dependents.get(obj.Name, {}).values() \
+                for dep, prop, attr in entries]
+
+    ## Document observer slots
+
+    def slotChangedObject(self, obj, prop):
+        if prop == 'ExpressionEngine' and obj.Document == self.doc:
+            self.unindexObject(obj.Name)
+            self.indexObject(obj)
+
+    def slotDeletedObject(self, obj):
+        if obj.Document == self.doc:
+            self.unindexObject(obj.Name)
+            self.dependents.pop(obj.Name, None)
+
+    def slotDeletedDocument(self, doc):
+        if doc == self.doc:
+            FreeCAD.removeDocumentObserver(self)
+            expressionIndexes.pop(doc.Name, None)
+
+expressionIndexes = {} ## Document name -> ExpressionIndex
+
+def getExpressionIndex(doc=None):
+    ''' Return the ExpressionIndex of doc (active document by default),
+    building it the first time it is requested '''
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    if doc.Name not in expressionIndexes:
+        expressionIndexes[doc.Name] = ExpressionIndex(doc)
+    return expressionIndexes[doc.Name]
+
+class SelectionRegistry:
+    ''' Ordered collection of SelectedObject keyed by (object name,
+    selection type): lookup and insertion take constant time '''
+
+    def __init__(self):
+        self.items = {}
+        self.types = {} ## Selection type -> SelectedObjects of that type
+        self.names = set() ## Names of the objects in the registry
+        ## SelectedObjects waiting for their relations to be resolved
+        ## (None when no traversal is going on, see SelectedObject)
+        self.queue = None
+        ## Circular relations met: lists of object names, first and last
+        ## being the same object
+        self.cycles = []
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, so):
+        return self.items.get((so.name, so.selectionType)) is so
+
+    def get(self, obj, sel_type):
+        ''' Return the SelectedObject of obj as sel_type (None if missing) '''
+        return self.items.get((obj.Name, sel_type))
+
+    def append(self, so):
+        ''' Register so unless its (object, type) is already present and
+        return the registered SelectedObject '''
+        key = (so.name, so.selectionType)
+        if key not in self.items:
+            self.items[key] = so
+            self.types.setdefault(so.selectionType, []).append(so)
+            self.names.add(so.name)
+        return self.items[key]
+
+    def ofType(self, sel_type):
+        ''' Return the SelectedObjects of type sel_type '''
+        return list(self.types.get(sel_type, []))
+
+class SelectedObject:
+    ''' A class to get all the connection between selected objects and their
+    bases, additions and dependencies. It only reads the document: ghosts
+    and visibility are handled by bimEdit.SelectedObject.
+    The relations are walked iteratively: the first SelectedObject created in
+    a registry resolves the whole graph from a work queue, the ones it 
+    creates meanwhile just wait for their turn there '''
+
+    __slots__ = ('obj', 'name', 'selectionType', 'isDependency', 'parents',
+            'additions', 'dependencies', 'base', 'origin', 'link')
+
+    def __init__(self, obj, sel=None, sel_type='main', parent=None):
+        if sel is None:
+            sel = SelectionRegistry()
+        self.obj = obj
+        self.name = obj.Name
+        self.selectionType = sel_type
+        self.isDependency = True if 'dependency' in self.selectionType \
+                else False
+        ## Objects based on this one (there can be more than one when 
+        ## several selected objects share the same base)
+        self.parents = [parent] if parent else []
+        ## Direct additions only (see allAdditions)
+        self.additions = []
+        self.dependencies = {}
+        self.base = None
+        ## The SelectedObject whose relations led to this one and the 
+        ## relation ('base', 'addition' or 'dependency')
+        self.origin = None
+        self.link = None
+        ## Populate caller selection list before walking the relations,
+        ## so that they can find this object in it
+        sel.append(self)
+        if sel.queue is not None:
+            sel.queue.append(self)
+        else:
+            self.resolveGraph(sel)
+
+    def resolveGraph(self, sel):
+        ''' Resolve the relations of this object and of every object
+        reached meanwhile. Circular relations are not followed, those made
+        of Base and Additions links are reported (see relate) '''
+        sel.queue = collections.deque([self])
+        found = len(sel.cycles)
+        try:
+            while sel.queue:
+                sel.queue.popleft().resolve(sel)
+        finally:
+            sel.queue = None
+        for cycle in sel.cycles[found:]:
+            FreeCAD.Console.PrintWarning('bimEdit: circular relation ' + \
+                    'ignored: ' + ' -> '.join(cycle) + '\n')
+
+    def resolve(self, sel):
+        ''' Create the SelectedObjects of base, additions and dependencies 
+        (they are resolved later from the queue of sel) '''
+        self.base = self.setBase(self.obj, sel)
+        self.populateAdditions(sel)
+        self.populateDependencies(sel)
+
+    def lineage(self):
+        ''' Return the names of the objects whose relations led to this one,
+        this one first '''
+        names = []
+        so = self
+        while so:
+            ## An object can be its own base
+            if not names or names[-1] != so.name:
+                names.append(so.name)
+            so = so.origin
+        return names
+
+    def relate(self, obj, sel, sel_type, link, parent=None):
+        ''' Return the SelectedObject of obj as sel_type, reached through 
+        link, creating it if needed. Return None if obj is one of the objects
+        this one comes from: if only Base and Additions lead back to obj the
+        circular relation is recorded in sel.cycles '''
+        so = sel.get(obj, sel_type)
+        if so:
+            return so
+        if obj.Name in sel.names:
+            lineage = self.lineage()
+            if obj.Name in lineage:
+                ## From obj back to obj through this object
+                cycle = lineage[:lineage.index(obj.Name) + 1][::-1]
+                links = [link]
+                so = self
+                while so.name != obj.Name:
+                    links.append(so.link)
+                    so = so.origin
+                ## An expression may read the object it depends on (the 
+                ## height of a wall from its own base): not a real cycle
+                if 'dependency' not in links and \
+                        cycle + [obj.Name] not in sel.cycles:
+                    sel.cycles.append(cycle + [obj.Name])
+                return None
+        so = type(self)(obj, sel, sel_type, parent)
+        so.origin = self
+        so.link = link
+        return so
+
+    def setBase(self, obj, sel):
+        ''' Create a SelectedObject for the base of the object.
+         If is a base yet, create a new one and set its parent to None 
+         to avoid infinite recursive call '''
+
+        if 'Base' in self.obj.PropertiesList and obj.Base:
+            base = sel.get(obj.Base, self.selectionType + '_base')
+            if not base:
+                return self.relate(obj.Base, sel, 
+                        self.selectionType + '_base', 'base', self)
+            ## Base is shared with another selected object
+            if self not in base.parents:
+                base.parents.append(self)
+            return base
+        elif 'base' not in self.selectionType:
+            base = sel.get(obj, self.selectionType + '_base')
+            if not base:
+                ## The object is its own base
+                base = type(self)(obj, sel, self.selectionType + '_base', 
+                        None)
+                base.origin = self
+                base.link = 'base'
+            return base
+        else:
+            return None
+
+    def populateDependencies(self, sel):
+        ''' Create a SelectedObject for every object that uses this one in
+        its expressions (see ExpressionIndex) '''
+        index = getExpressionIndex(self.obj.Document)
+        for dep, prop, local_attr in index.getDependents(self.obj):
+            dep_type = self.selectionType + '_dependency'
+            ## Create a new SelectedObject for every dependency not yet in
+            ## the selection list
+            so = self.relate(dep, sel, dep_type, 'dependency')
+            if so:
+                self.dependencies.setdefault(local_attr, []).append((so, prop))
+
+    def populateAdditions(self, sel):
+        ''' Create a SelectedObject for every addition. Additions of 
+        additions get theirs when they are resolved (see allAdditions) '''
+        obj = self.obj
+        if 'Additions' in obj.PropertiesList and len(obj.Additions) > 0:
+            for o in obj.Additions:
+                ## A new SelectedObject of type "addition" is created only if
+                ## obj is not present in the selection list as "addition"
+                s = self.relate(o, sel, 'addition', 'addition')
+                if s:
+                    self.additions.append(s)
+
+    def allAdditions(self):
+        ''' Return the additions of this object and, at any depth, the
+        additions of its additions '''
+        found = {}
+        stack = list(reversed(self.additions))
+        while stack:
+            so = stack.pop()
+            if so.name not in found and so is not self:
+                found[so.name] = so
+                stack += reversed(so.additions)
+        return list(found.values())
+
+### Batch operations ###
+
+def subgraphOf(to_edit):
+    ''' Return the SelectedObjects to_edit together with the objects based
+    on them at any depth (object name -> SelectedObject, objects to edit 
+    first) '''
+    subgraph = {}
+    queue = list(to_edit)
+    while queue:
+        sel = queue.pop(0)
+        if sel.name not in subgraph:
+            subgraph[sel.name] = sel
+            queue += sel.parents
+    return subgraph
+
+def copyObjects(originals, doc=None):
+    ''' Copy the objects originals: Base and Additions links between them
+    are moved to the copies. Return the copies (object name -> copy) '''
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    try:
+        copies = doc.copyObject(originals)
+    except TypeError:
+        ## Copy of a list of objects needs FreeCAD 0.19
+        copies = [doc.copyObject(o) for o in originals]
+    memo = {o.Name: c for o, c in zip(originals, copies)}
+    for o, c in zip(originals, copies):
+        if 'Base' in o.PropertiesList and o.Base and o.Base.Name in memo:
+            c.Base = memo[o.Base.Name]
+        if 'Additions' in o.PropertiesList and len(o.Additions) > 0:
+            c.Additions = [memo[a.Name] for a in o.Additions if a.Name in memo]
+    return memo
+
+def compactNames(names):
+    ''' Squeeze a list of object names in a short string: consecutive 
+    names with the same prefix and following numbers (Wall001, Wall002, 
+    Wall003...) become a range (Wall001-003). See expandNames '''
+    spans = [] ## [prefix, first number, last number]
+    for name in names:
+        m = re.match(r'^(.*?)(\d+)$', name)
+        if not m:
+            spans.append([name, '', None])
+            continue
+        prefix, num = m.groups()
+        last = spans[-1] if spans else None
+        if last and last[0] == prefix and last[2] is not None \
+                and int(num) == last[2] + 1 and len(num) == len(last[1]):
+            last[2] += 1
+        else:
+            spans.append([prefix, num, int(num)])
+    items = []
+    for prefix, first, last in spans:
+        if last is None or last == int(first):
+            items.append(prefix + first)
+        else:
+            items.append(prefix + first + '-' + str(last).zfill(len(first)))
+    return ','.join(items)
+
+def expandNames(names):
+    ''' Get back the list of object names squeezed by compactNames '''
+    expanded = []
+    for item in names.split(','):
+        m = re.match(r'^(.*?)(\d+)-(\d+)$', item)
+        if m:
+            prefix, first, last = m.groups()
+            expanded += [prefix + str(i).zfill(len(first)) \
+                    for i in range(int(first), int(last) + 1)]
+        elif item:
+            expanded.append(item)
+    return expanded
+
+@profiled('commit')
+def batchMove(names, delta, doc=None):
+    ''' Move at once the objects of doc listed in names (see compactNames)
+    by delta. This is the call bimMove records in macros '''
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    objs = [doc.getObject(n) for n in expandNames(names)]
+    import Draft
+    Draft.move(objs, delta, copy=False)
+    recomputer.request(objs)
+    recomputer.flush()
+
+@profiled('commit')
+def batchRotate(names, angle, center, axis, doc=None):
+    ''' Rotate at once the objects of doc listed in names (see 
+    compactNames) by angle (degrees) around center and axis.
+    This is the call bimRotate records in macros '''
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    objs = [doc.getObject(n) for n in expandNames(names)]
+    import Draft
+    Draft.rotate(objs, angle, center, axis=axis, copy=False)
+    recomputer.request(objs)
+    recomputer.flush()
+
+### Snapping ###
+
+class SnapIndex:
+    ''' Vertices and edges of the shapes of objects in a grid of square 
+    cells (size long) on the plane of u and v: the snap point nearest to 
+    the cursor is found among the few cells around it instead of the 
+    whole scene. Curved edges are stored as segments (see deflection) '''
+
+    def __init__(self, u, v, size, deflection=10.):
+        self.u, self.v = u, v
+        self.size = float(size)
+        self.deflection = deflection
+        ## Cell -> [(x, y, point, object name)]
+        self.vertices = collections.defaultdict(list)
+        ## Cell -> [(xa, ya, xb, yb, a, b, object name)]
+        self.edges = collections.defaultdict(list)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def coords(self, p):
+        ''' Return the coordinates of p on the plane '''
+        return p.dot(self.u), p.dot(self.v)
+
+    def cell(self, x, y):
+        return int(math.floor(x / self.size)), int(math.floor(y / self.size))
+
+    def add(self, obj):
+        ''' Add the vertices and the edges of the shape of obj '''
+        shape = getattr(obj, 'Shape', None)
+        if not shape or shape.isNull():
+            return
+        for vertex in shape.Vertexes:
+            x, y = self.coords(vertex.Point)
+            self.vertices[self.cell(x, y)].append((x, y, vertex.Point, 
+                obj.Name))
+            self.count += 1
+        for edge in shape.Edges:
+            points = edge.discretize(QuasiDeflection=self.deflection)
+            coords = [self.coords(p) for p in points]
+            for i in range(len(points) - 1):
+                self.addSegment(coords[i] + coords[i + 1] + \
+                        (points[i], points[i + 1], obj.Name))
+
+    def addSegment(self, segment):
+        ''' Store segment (see edges) in every cell it crosses '''
+        xa, ya, xb, yb = segment[:4]
+        steps = int(2 * max(abs(xb - xa), abs(yb - ya)) / self.size) + 1
+        cells = set(self.cell(xa + (xb - xa) * i / steps, 
+            ya + (yb - ya) * i / steps) for i in range(steps + 1))
+        for c in cells:
+            self.edges[c].append(segment)
+        self.count += 1
+
+    def near(self, table, x, y, radius):
+        ''' Return the items of table (vertices or edges) in the cells 
+        within radius from (x, y) '''
+        (i0, j0), (i1, j1) = self.cell(x - radius, y - radius), \
+                self.cell(x + radius, y + radius)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(table):
+            cells = [c for c in table \
+                    if i0 <= c[0] <= i1 and j0 <= c[1] <= j1]
+        else:
+            cells = [(i, j) for i in range(i0, i1 + 1) \
+                    for j in range(j0, j1 + 1) if (i, j) in table]
+        return [item for c in cells for item in table[c]]
+
+    def nearest(self, point, radius, kinds=('endpoint', 'passive')):
+        ''' Return the snap point nearest to point (distances are 
+        measured on the plane) as (point, kind, object name), kind being 
+        'endpoint' or 'passive' (on an edge) and one of kinds. Vertices 
+        win over edges. None if nothing is within radius '''
+        x, y = self.coords(point)
+        best = None
+        vertices = self.vertices if 'endpoint' in kinds else {}
+        edges = self.edges if 'passive' in kinds else {}
+        for px, py, p, name in self.near(vertices, x, y, radius):
+            d = math.hypot(px - x, py - y)
+            if d <= radius and (not best or d < best[0]):
+                best = (d, p, 'endpoint', name)
+        if best:
+            return best[1:]
+        for xa, ya, xb, yb, a, b, name in self.near(edges, x, y, radius):
+            length = (xb - xa) ** 2 + (yb - ya) ** 2
+            t = ((x - xa) * (xb - xa) + (y - ya) * (yb - ya)) / length \
+                    if length else 0.
+            t = min(1., max(0., t))
+            d = math.hypot(xa + (xb - xa) * t - x, ya + (yb - ya) * t - y)
+            if d <= radius and (not best or d < best[0]):
+                best = (d, a.add(b.sub(a).multiply(t)), 'passive', name)
+        return best[1:] if best else None
@@ -19,68 +19,235 @@
 #*                                                                             *
 #*******************************************************************************
 
-import FreeCAD, FreeCADGui, Draft, math, DraftGui
+import FreeCAD, FreeCADGui, Draft, math, DraftGui, time
+from PySide import QtCore
 from DraftGui import todo, translate, utf8_decode
 from FreeCAD import Vector
 from DraftTools import Modifier, msg, selectObject, plane, \
-        getPoint, redraw3DView, hasMod, MODALT, DraftVecUtils, \
-        Move, Rotate
+        getPoint, redraw3DView, hasMod, MODALT, MODCONSTRAIN, MODSNAP, \
+        DraftVecUtils, Move, Rotate
 from DraftTrackers import ghostTracker, arcTracker
-
-
-def replica(to_edit):
-    ''' Create a replica, even maintaining relations between additions, 
-    and return it in a list of new object to copy ''' 
-    from bimEdit import hideAttribute
-    to_copy = []
-    copy_adds = {}
-    for sel in to_edit:
-        new_obj = FreeCAD.ActiveDocument.copyObject(sel.obj)
-        adds = sel.obj.Additions if 'Additions' in sel.obj.PropertiesList \
-                else None
-        if adds and len(adds) > 0:
-            new_obj.Additions = []
-        for attr in hideAttribute:
-            setattr(new_obj.ViewObject, attr, sel.attr[attr])
-        copy_adds.update({
-            sel.obj: {'copy':new_obj, 'additions': adds}})
-        to_copy.append(new_obj)
-        if sel.parent:
-            new_parent = FreeCAD.ActiveDocument.copyObject(sel.parent.obj)
-            if 'Additions' in new_parent.PropertiesList \
-                    and len(new_parent.Additions) > 0:
-                new_parent.Additions = []
-            copy_adds.update({
-                sel.parent.obj: {'copy':new_parent, 
-                    'additions': sel.parent.obj.Additions}})
-            new_parent.Base = new_obj
-            for attr in hideAttribute:
-                setattr(new_parent.ViewObject, attr, sel.parent.attr[attr])
-    #print({c.Name: copy_adds[c] for c in copy_adds})
-    for o in copy_adds:
-        if copy_adds[o]['additions']:
-            copy_adds[o]['copy'].Additions = [copy_adds[a]['copy'] \
-                    for a in copy_adds[o]['additions'] if a in copy_adds]
-    return to_copy
-
+from bimEdit_core import profiled, recomputer, compactNames, \
+        expandNames, SnapIndex, subgraphOf, copyObjects
+
+
+def copyViews(memo, doc=None):
+    ''' Give the copies in memo (original name -> copy, see 
+    bimEdit_core.copyObjects) the view properties of their originals, 
+    as they were before bimEdit hid them (see hiddenViews in bimEdit) '''
+    from bimEdit import ViewStateBatch, hideAttribute, hiddenViews
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    batch = ViewStateBatch()
+    for name, copy in memo.items():
+        view = doc.getObject(name).ViewObject
+        if not view or not copy.ViewObject:
+            continue
+        state = hiddenViews.get((doc.Name, name)) or \
+                {attr: getattr(view, attr) for attr in hideAttribute}
+        for attr, value in state.items():
+            batch.set(copy.ViewObject, attr, value)
+    batch.apply()
+
+def replicateNames(originals, edit, doc):
+    ''' Copy originals with their view properties (see copyViews) and 
+    return the copies of the objects listed in edit (see compactNames) '''
+    memo = copyObjects(originals, doc)
+    copyViews(memo, doc)
+    return [memo[n] for n in expandNames(edit)]
+
+@profiled('commit')
+def batchArray(names, edit, count, delta=None, angle=0., center=None,
+        axis=None, doc=None):
+    ''' Create count replicas of the objects of doc listed in names (see 
+    compactNames and bimEdit_core.copyObjects), recomputed at once. In the
+    i-th replica the copies of the objects listed in edit are moved by 
+    delta * i or rotated by angle * i (degrees) around center and axis.
+    If anything fails the transaction is aborted.
+    This is the call the array and copy modes of bimMove and bimRotate 
+    record in macros '''
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    originals = [doc.getObject(n) for n in expandNames(names)]
+    copies = []
+    try:
+        for i in range(1, count + 1):
+            objs = replicateNames(originals, edit, doc)
+            if delta:
+                Draft.move(objs, delta * i, copy=False)
+            if angle:
+                Draft.rotate(objs, angle * i, center, axis=axis, copy=False)
+            copies += objs
+        recomputer.request(copies)
+        recomputer.flush()
+    except Exception:
+        doc.abortTransaction()
+        raise
+    return copies
+
+@profiled('commit')
+def batchScale(names, delta, center, doc=None, edit=None):
+    ''' Scale at once the objects of doc listed in names (see compactNames)
+    by delta around center (see scale). If edit is given, the objects 
+    listed in names are replicated first and the copies of the objects 
+    listed in edit are scaled instead (see batchArray).
+    This is the call bimScale records in macros '''
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    objs = [doc.getObject(n) for n in expandNames(names)]
+    try:
+        if edit:
+            objs = replicateNames(objs, edit, doc)
+        scale(objs, delta, center, copy=False)
+        recomputer.request(objs)
+        recomputer.flush()
+    except Exception:
+        doc.abortTransaction()
+        raise
+    return objs
+
+@profiled('snapIndex')
+def staticSnapIndex(sel_dict, doc=None):
+    ''' Return a SnapIndex (see bimEdit_core) on the working plane of the 
+    visible objects of doc that stay still: the objects of sel_dict are
+    left out (they move or are hidden behind their ghosts), and so are the 
+    ghosts, that are not document objects '''
+    from bimEdit import settings
+    if not doc:
+        doc = FreeCAD.ActiveDocument
+    involved = set(so.name for typ in sel_dict for so in sel_dict[typ])
+    index = SnapIndex(plane.u, plane.v, settings['snapCell'])
+    for obj in doc.Objects:
+        if obj.Name not in involved and obj.ViewObject and \
+                obj.ViewObject.Visibility:
+            index.add(obj)
+    return index
+
+def snapPoint(target, arg):
+    ''' Return what getPoint(target, arg) does, snapping to the objects
+    of target.snapIndex without searching the scene when one of them is
+    within the snap range of the cursor. The index is built the first time
+    it is needed (see staticSnapIndex). Draft snapping settings are 
+    followed (snap on, endpoint and near snaps); Draft snapping (grid, 
+    constraints, views not aligned to the working plane) takes over when 
+    nothing is found '''
+    snapper = getattr(FreeCADGui, 'Snapper', None)
+    view = target.view
+    if snapper and getattr(snapper, 'active', True) and \
+            (Draft.getParam("alwaysSnap", True) or hasMod(arg, MODSNAP)) and \
+            not hasMod(arg, MODCONSTRAIN) and \
+            abs(view.getViewDirection().dot(plane.axis)) > .999:
+        kinds = [k for k in ('endpoint', 'passive') if snapper.isEnabled(k)]
+        if kinds and target.snapIndex is None:
+            target.snapIndex = staticSnapIndex(target.sel_dict)
+        x, y = arg["Position"][0], arg["Position"][1]
+        cursor = view.getPoint(x, y)
+        radius = view.getPoint(x + Draft.getParam("snapRange", 8), y)\
+                .sub(cursor).Length
+        found = target.snapIndex.nearest(cursor, radius, kinds) \
+                if kinds else None
+        if found:
+            point, kind, name = found
+            if getattr(snapper, 'tracker', None):
+                snapper.tracker.setCoords(point)
+                snapper.tracker.setMarker(snapper.mk[kind])
+                snapper.tracker.on()
+            if target.ui:
+                target.ui.displayPoint(point, 
+                        target.node[-1] if target.node else None, plane=plane)
+            return point, None, {'Document': FreeCAD.ActiveDocument.Name,
+                    'Object': name, 'Component': kind, 
+                    'x': point.x, 'y': point.y, 'z': point.z}
+    return getPoint(target, arg)
+
+class eventPacer:
+    ''' Coalesce the mouse movement events of a command: handler is called 
+    once per frame (rate is the number of frames per second) with the latest
+    event only. The latency of every event, from its arrival to the end of 
+    its handling, is recorded '''
+
+    def __init__(self, handler, rate):
+        self.handler = handler
+        self.interval = int(1000 / rate) if rate else 0
+        self.pending = None
+        self.arrivals = []
+        self.latency = []
+        self.handled = 0
+
+    def push(self, arg):
+        ''' Take note of the event and schedule its handling '''
+        if not self.arrivals:
+            QtCore.QTimer.singleShot(self.interval, self.flush)
+        self.pending = arg
+        self.arrivals.append(time.perf_counter())
+
+    def flush(self):
+        ''' Handle the latest pending event (if any) '''
+        if not self.arrivals:
+            return
+        arg, arrivals = self.pending, self.arrivals
+        self.pending, self.arrivals = None, []
+        self.handler(arg)
+        self.handled += 1
+        done = time.perf_counter()
+        self.latency += [done - t for t in arrivals]
+
+    def cancel(self):
+        ''' Drop the pending event '''
+        self.pending, self.arrivals = None, []
+
+    def report(self, name):
+        ''' Print a summary of the recorded latencies '''
+        if not self.latency:
+            return
+        latency = sorted(self.latency)
+        FreeCAD.Console.PrintMessage(('{}: {} mouse events, {} handled. ' + \
+                'Latency (ms): mean {:.1f}, 95th percentile {:.1f}, ' + \
+                'max {:.1f}\n').format(name, len(latency), self.handled,
+                    1000 * sum(latency) / len(latency), 
+                    1000 * latency[int(.95 * (len(latency) - 1))],
+                    1000 * latency[-1]))
+
+
+def finalizeGhosts(ghost):
+    ''' Switch off and finalize the trackers of ghost (selection type ->
+    trackers). finish can run twice (bimScale.scale calls it itself): 
+    trackers finalized yet are skipped '''
+    if not ghost:
+        return
+    for typ in ghost:
+        for g in ghost[typ]:
+            if g.switch:
+                g.off()
+                g.finalize()
 
 class bimMove(Move):
     "The bimMove command definition"
 
-    def __init__(self, sel_dict):
+    def __init__(self, sel_dict, trans, count=1):
         super().__init__()
         self.sel_dict = sel_dict
+        ## SoTransform shared by the ghosts to be moved
+        self.trans = trans
+        ## More than one: create an array of count copies
+        self.count = count
+        self.pacer = None
+        ## Snap targets of the still objects (see snapPoint), built on the 
+        ## first snap and kept for all the runs of the command
+        self.snapIndex = None
 
     def Activated(self):
-        from bimEdit import hideAttribute
+        from bimEdit import hideAttribute, settings
         self.name = translate("draft","bimMove", utf8_decode=True)
         Modifier.Activated(self,self.name)
+        if settings['framePaced']:
+            self.pacer = eventPacer(self.locationEvent, settings['frameRate'])
         self.ghost = {}
         for typ in self.sel_dict:
             if typ not in self.ghost:
                 self.ghost.update({typ:[]})
             for o in self.sel_dict[typ]:
-                self.ghost[typ].append(o.ghost[typ])
+                self.ghost[typ].append(o.getGhost(typ))
 
         ## Proceeding
         if self.call:
@@ -96,12 +263,10 @@ class bimMove(Move):
         msg(translate("draft", "Pick start point:")+"\n")
 
     def finish(self,closed=False,cont=False):
-        if self.ghost:
-            for typ in self.ghost:
-                for g in [i for i in self.ghost[typ]]:
-                    if g.switch:
-                        g.off()
-                    g.finalize()
+        if self.pacer:
+            self.pacer.cancel()
+            self.pacer.report(self.name)
+        finalizeGhosts(self.ghost)
         if cont and self.ui:
             if self.ui.continueMode:
                 todo.delayAfter(self.Activated,[])
@@ -109,46 +274,53 @@ class bimMove(Move):
 
     def move(self,delta,copy=False):
         "moving the real shape's bases"
-        FreeCADGui.addModule("Draft")
+        FreeCADGui.addModule("bimEdit_core")
         sel_to_edit = [o for typ in self.sel_dict \
                 for o in self.sel_dict[typ] if typ == 'toEdit']
-        if copy:
-            obj_to_edit = replica(sel_to_edit)
-        else:
-            obj_to_edit = [s.obj for s in sel_to_edit]
-
-        sel = '['
-        for o in obj_to_edit:
-            if len(sel) > 1:
-                sel += ','
-            sel += 'FreeCAD.ActiveDocument.' + o.Name
-        sel += ']'
-
+        if copy or self.count > 1:
+            ## Linear array: every copy is delta away from the previous one.
+            ## A single copy is an array of one, so it is made by name 
+            ## inside the commit too
+            FreeCADGui.addModule("bimEdit_overrides")
+            self.commit(translate("draft","Array" if self.count > 1 \
+                    else "Copy"),
+                ['bimEdit_overrides.batchArray("'+ \
+                    compactNames(list(subgraphOf(sel_to_edit)))+'","'+ \
+                    compactNames(list(dict.fromkeys(s.name \
+                        for s in sel_to_edit)))+'",'+str(max(self.count,1))+ \
+                    ',delta='+DraftVecUtils.toString(delta)+')'])
+            return
+        obj_to_edit = [s.obj for s in sel_to_edit]
+
+        names = compactNames([o.Name for o in obj_to_edit])
         self.commit(translate("draft","Move"),
-            ['Draft.move('+sel+','+DraftVecUtils.toString(delta)+ \
-                ',copy=False)', 'FreeCAD.ActiveDocument.recompute()'])
+            ['bimEdit_core.batchMove("'+names+'",'+ \
+                DraftVecUtils.toString(delta)+')'])
+
+    def locationEvent(self,arg):
+        "mouse movement handler"
+        self.point,ctrlPoint,info = snapPoint(self,arg)
+        if (len(self.node) > 0):
+            last = self.node[len(self.node)-1]
+            delta = self.point.sub(last)
+            self.trans.translation.setValue([delta.x,delta.y,delta.z])
+        if self.extendedCopy:
+            if not hasMod(arg,MODALT): self.finish()
+        redraw3DView()
 
     def action(self,arg):
         "scene event handler"
+        if self.pacer:
+            if arg["Type"] == "SoLocation2Event":
+                self.pacer.push(arg)
+                return
+            ## Other events need the latest point
+            self.pacer.flush()
         if arg["Type"] == "SoKeyboardEvent":
             if arg["Key"] == "ESCAPE":
                 self.finish()
         elif arg["Type"] == "SoLocation2Event": #mouse movement detection
-            #if self.ghost:
-            #    self.ghost.off()
-            self.point,ctrlPoint,info = getPoint(self,arg)
-            if (len(self.node) > 0):
-                last = self.node[len(self.node)-1]
-                delta = self.point.sub(last)
-                if self.ghost:
-                    for typ in self.ghost:
-                        if typ == 'toEdit' or typ == 'dirDeps':
-                            for g in [i for i in self.ghost[typ]]:
-                                g.move(delta)
-                                g.on()
-            if self.extendedCopy:
-                if not hasMod(arg,MODALT): self.finish()
-            redraw3DView()
+            self.locationEvent(arg)
         elif arg["Type"] == "SoMouseButtonEvent":
             if (arg["State"] == "DOWN") and (arg["Button"] == "BUTTON1"):
                 if self.point:
@@ -200,20 +372,30 @@ class bimMove(Move):
 class bimRotate(Rotate):
     "The bimMove command definition"
 
-    def __init__(self, sel_dict):
+    def __init__(self, sel_dict, trans, count=1):
         super().__init__()
         self.sel_dict = sel_dict
+        ## SoTransform shared by the ghosts to be rotated
+        self.trans = trans
+        ## More than one: create a polar array of count copies
+        self.count = count
+        self.pacer = None
+        ## Snap targets of the still objects (see snapPoint), built on the 
+        ## first snap and kept for all the runs of the command
+        self.snapIndex = None
 
     def Activated(self):
-        from bimEdit import hideAttribute
+        from bimEdit import hideAttribute, settings
         self.name = translate("draft","bimRotate", utf8_decode=True)
         Modifier.Activated(self,self.name)
+        if settings['framePaced']:
+            self.pacer = eventPacer(self.locationEvent, settings['frameRate'])
         self.ghost = {}
         for typ in self.sel_dict:
             if typ not in self.ghost:
                 self.ghost.update({typ:[]})
             for o in self.sel_dict[typ]:
-                self.ghost[typ].append(o.ghost[typ])
+                self.ghost[typ].append(o.getGhost(typ))
         self.arctrack = None
 
         ## Proceeding
@@ -231,42 +413,45 @@ class bimRotate(Rotate):
 
     def finish(self,closed=False,cont=False):
         "finishes the arc"
+        if self.pacer:
+            self.pacer.cancel()
+            self.pacer.report(self.name)
         if self.arctrack:
             self.arctrack.finalize()
-        if self.ghost:
-            for typ in self.ghost:
-                for g in [i for i in self.ghost[typ]]:
-                    if g.switch:
-                        g.off()
-                    g.finalize()
+        finalizeGhosts(self.ghost)
         if cont and self.ui:
             if self.ui.continueMode:
                 todo.delayAfter(self.Activated,[])
         Modifier.finish(self)
-        if self.doc:
-            self.doc.recompute()
+        recomputer.flush()
 
     def rot (self,angle,copy=False):
         "rotating the real shapes'bases"
-        FreeCADGui.addModule("Draft")
+        FreeCADGui.addModule("bimEdit_core")
         sel_to_edit = [o for typ in self.sel_dict \
                 for o in self.sel_dict[typ] if typ == 'toEdit']
-        if copy:
-            obj_to_edit = replica(sel_to_edit)
-        else:
-            obj_to_edit = [s.obj for s in sel_to_edit]
-
-        sel = '['
-        for o in obj_to_edit:
-            if len(sel) > 1:
-                sel += ','
-            sel += 'FreeCAD.ActiveDocument.'+o.Name
-        sel += ']'
-            
+        if copy or self.count > 1:
+            ## Polar array: every copy is rotated by angle from the previous 
+            ## one around the picked center; a single copy is an array of one
+            FreeCADGui.addModule("bimEdit_overrides")
+            self.commit(translate("draft","Array" if self.count > 1 \
+                    else "Copy"),
+                ['bimEdit_overrides.batchArray("'+ \
+                    compactNames(list(subgraphOf(sel_to_edit)))+'","'+ \
+                    compactNames(list(dict.fromkeys(s.name \
+                        for s in sel_to_edit)))+'",'+str(max(self.count,1))+ \
+                    ',angle='+str(math.degrees(angle))+ \
+                    ',center='+DraftVecUtils.toString(self.center)+ \
+                    ',axis='+DraftVecUtils.toString(plane.axis)+')'])
+            return
+        obj_to_edit = [s.obj for s in sel_to_edit]
+
+        names = compactNames([o.Name for o in obj_to_edit])
         self.commit(translate("draft","Rotate"),
-            ['Draft.rotate('+sel+','+str(math.degrees(angle))+','+ \
-                    DraftVecUtils.toString(self.center)+',axis='+ \
-                    DraftVecUtils.toString(plane.axis)+',copy=False)'])
+            ['bimEdit_core.batchRotate("'+names+'",'+ \
+                    str(math.degrees(angle))+','+ \
+                    DraftVecUtils.toString(self.center)+','+ \
+                    DraftVecUtils.toString(plane.axis)+')'])
 
         ## TODO define behaviour for rotation around non-z axis
         #for ob in obj_to_edit:
@@ -278,58 +463,62 @@ class bimRotate(Rotate):
         #        print(ob.Normal)
         #        App.activeDocument().recompute()
 
+    def locationEvent(self,arg):
+        "mouse movement handler"
+        self.point,ctrlPoint,info = snapPoint(self,arg)
+        # this is to make sure radius is what you see on screen
+        if self.center and DraftVecUtils.dist(self.point,self.center):
+            viewdelta = DraftVecUtils.project(self.point.sub(self.center),
+                    plane.axis)
+            if not DraftVecUtils.isNull(viewdelta):
+                self.point = self.point.add(viewdelta.negative())
+        if self.extendedCopy:
+            if not hasMod(arg,MODALT):
+                self.step = 3
+                self.finish()
+        if (self.step == 0):
+            pass
+        elif (self.step == 1):
+            currentrad = DraftVecUtils.dist(self.point,self.center)
+            if (currentrad != 0):
+                angle = DraftVecUtils.angle(plane.u,
+                        self.point.sub(self.center), plane.axis)
+            else: angle = 0
+            self.ui.setRadiusValue(math.degrees(angle),unit="Angle")
+            self.firstangle = angle
+            self.ui.radiusValue.setFocus()
+            self.ui.radiusValue.selectAll()
+        elif (self.step == 2):
+            currentrad = DraftVecUtils.dist(self.point,self.center)
+            if (currentrad != 0):
+                angle = DraftVecUtils.angle(plane.u, 
+                        self.point.sub(self.center), plane.axis)
+            else: angle = 0
+            if (angle < self.firstangle):
+                sweep = (2*math.pi-self.firstangle)+angle
+            else:
+                sweep = angle - self.firstangle
+            self.arctrack.setApertureAngle(sweep)
+            self.trans.rotation.setValue([plane.axis.x,plane.axis.y,
+                plane.axis.z],sweep)
+            self.ui.setRadiusValue(math.degrees(sweep), 'Angle')
+            self.ui.radiusValue.setFocus()
+            self.ui.radiusValue.selectAll()
+        redraw3DView()
+
     def action(self,arg):
         "scene event handler"
+        if self.pacer:
+            if arg["Type"] == "SoLocation2Event":
+                self.pacer.push(arg)
+                return
+            ## Other events need the latest point
+            self.pacer.flush()
         if arg["Type"] == "SoKeyboardEvent":
             if arg["Key"] == "ESCAPE":
                 self.finish()
         elif arg["Type"] == "SoLocation2Event":
-            #if self.ghost:
-            #    self.ghost.off()
-            self.point,ctrlPoint,info = getPoint(self,arg)
-            # this is to make sure radius is what you see on screen
-            if self.center and DraftVecUtils.dist(self.point,self.center):
-                viewdelta = DraftVecUtils.project(self.point.sub(self.center),
-                        plane.axis)
-                if not DraftVecUtils.isNull(viewdelta):
-                    self.point = self.point.add(viewdelta.negative())
-            if self.extendedCopy:
-                if not hasMod(arg,MODALT):
-                    self.step = 3
-                    self.finish()
-            if (self.step == 0):
-                pass
-            elif (self.step == 1):
-                currentrad = DraftVecUtils.dist(self.point,self.center)
-                if (currentrad != 0):
-                    angle = DraftVecUtils.angle(plane.u,
-                            self.point.sub(self.center), plane.axis)
-                else: angle = 0
-                self.ui.setRadiusValue(math.degrees(angle),unit="Angle")
-                self.firstangle = angle
-                self.ui.radiusValue.setFocus()
-                self.ui.radiusValue.selectAll()
-            elif (self.step == 2):
-                currentrad = DraftVecUtils.dist(self.point,self.center)
-                if (currentrad != 0):
-                    angle = DraftVecUtils.angle(plane.u, 
-                            self.point.sub(self.center), plane.axis)
-                else: angle = 0
-                if (angle < self.firstangle):
-                    sweep = (2*math.pi-self.firstangle)+angle
-                else:
-                    sweep = angle - self.firstangle
-                self.arctrack.setApertureAngle(sweep)
-                if self.ghost:
-                    for typ in self.ghost:
-                        if typ == 'toEdit' or typ == 'dirDeps':
-                            for g in [i for i in self.ghost[typ]]:
-                                g.rotate(plane.axis,sweep)
-                                g.on()
-                self.ui.setRadiusValue(math.degrees(sweep), 'Angle')
-                self.ui.radiusValue.setFocus()
-                self.ui.radiusValue.selectAll()
-            redraw3DView()
+            self.locationEvent(arg)
 
         elif arg["Type"] == "SoMouseButtonEvent":
             if (arg["State"] == "DOWN") and (arg["Button"] == "BUTTON1"):
@@ -343,11 +532,8 @@ class bimRotate(Rotate):
                         self.ui.hasFill.hide()
                         self.ui.labelRadius.setText("Base angle")
                         self.arctrack.setCenter(self.center)
-                        if self.ghost:
-                            for typ in self.ghost:
-                                if typ == 'toEdit' or typ == 'dirDeps':
-                                    for g in [i for i in self.ghost[typ]]:
-                                        g.center(self.center)
+                        self.trans.center.setValue(self.center.x,
+                                self.center.y,self.center.z)
                         self.step = 1
                         msg(translate("draft", "Pick base angle:")+"\n")
                         if self.planetrack:
@@ -389,11 +575,7 @@ class bimRotate(Rotate):
         self.center = Vector(numx,numy,numz)
         self.node = [self.center]
         self.arctrack.setCenter(self.center)
-        if self.ghost:
-            for typ in self.ghost:
-                if typ == 'toEdit' or typ == 'dirDeps':
-                    for g in [i for i in self.ghost[typ]]:
-                        g.center(self.center)
+        self.trans.center.setValue(self.center.x,self.center.y,self.center.z)
         self.ui.radiusUi()
         self.ui.hasFill.hide()
         self.ui.labelRadius.setText("Base angle")
@@ -420,8 +602,14 @@ class bimRotate(Rotate):
 
 
 class bimScale(Modifier):
-    '''The Draft_Scale FreeCAD command definition.
-    This tool scales the selected objects from a base point.'''
+    '''The bimScale command definition.
+    This tool scales the objects to edit from a base point.'''
+
+    def __init__(self, sel_dict, trans):
+        super().__init__()
+        self.sel_dict = sel_dict
+        ## SoTransform shared by the ghosts to be scaled
+        self.trans = trans
 
     def GetResources(self):
         return {'Pixmap'  : 'Draft_Scale',
@@ -430,27 +618,23 @@ class bimScale(Modifier):
                 'ToolTip': QtCore.QT_TRANSLATE_NOOP("Draft_Scale", "Scales the selected objects from a base point. CTRL to snap, SHIFT to constrain, ALT to copy")}
 
     def Activated(self):
-        self.name = translate("draft","Scale", utf8_decode=True)
+        self.name = translate("draft","bimScale", utf8_decode=True)
         Modifier.Activated(self,self.name)
-        self.ghost = None
-        if self.ui:
-            if not FreeCADGui.Selection.getSelection():
-                self.ui.selectUi()
-                msg(translate("draft", "Select an object to scale")+"\n")
-                self.call = self.view.addEventCallback("SoEvent",selectObject)
-            else:
-                self.proceed()
+        self.ghost = {}
+        for typ in self.sel_dict:
+            if typ not in self.ghost:
+                self.ghost.update({typ:[]})
+            for o in self.sel_dict[typ]:
+                self.ghost[typ].append(o.getGhost(typ))
 
-    def proceed(self):
-        if self.call: self.view.removeEventCallback("SoEvent",self.call)
-        self.sel = FreeCADGui.Selection.getSelection()
-        self.sel = Draft.getGroupContents(self.sel)
+        ## Proceeding
+        if self.call:
+            self.view.removeEventCallback("SoEvent",self.call)
         self.refs = []
         self.ui.pointUi(self.name)
         self.ui.modUi()
         self.ui.xValue.setFocus()
         self.ui.xValue.selectAll()
-        self.ghost = ghostTracker(self.sel)
         self.pickmode = False
         self.task = None
         self.call = self.view.addEventCallback("SoEvent",self.action)
@@ -464,47 +648,40 @@ class bimScale(Modifier):
         self.call = self.view.addEventCallback("SoEvent",self.action)
 
     def finish(self,closed=False,cont=False):
+        finalizeGhosts(self.ghost)
         Modifier.finish(self)
-        if self.ghost:
-            self.ghost.finalize()
 
     def scale(self,x,y,z,rel,mode):
+        "scaling the real shapes"
         delta = Vector(x,y,z)
         if rel:
             delta = FreeCAD.DraftWorkingPlane.getGlobalCoords(delta)
-        if mode == 0:
-            copy = False
-            legacy = False
-        elif mode == 1:
-            copy = False
-            legacy = True
-        elif mode == 2:
-            copy = True
-            legacy = True
-        "moving the real shapes"
-        sel = '['
-        for o in self.sel:
-            if len(sel) > 1:
-                sel += ','
-            sel += 'FreeCAD.ActiveDocument.'+o.Name
-        sel += ']'
-        FreeCADGui.addModule("Draft")
-        self.commit(translate("draft","Copy"),
-                    ['Draft.scale('+sel+',delta='+DraftVecUtils.toString(delta)+',center='+DraftVecUtils.toString(self.node[0])+',copy='+str(copy)+',legacy='+str(legacy)+')',
-                     'FreeCAD.ActiveDocument.recompute()'])
+        ## mode 0: parametric scale (a clone, see numericInput), 1: direct 
+        ## scale, 2: direct scale of a copy
+        copy = mode == 2
+        FreeCADGui.addModule("bimEdit_overrides")
+        sel_to_edit = [o for typ in self.sel_dict \
+                for o in self.sel_dict[typ] if typ == 'toEdit']
+        names = compactNames(list(dict.fromkeys(s.name for s in sel_to_edit)))
+        ## Copies are made by name inside the commit (see batchScale)
+        edit = ',edit="'+names+'"' if copy else ''
+        if copy:
+            names = compactNames(list(subgraphOf(sel_to_edit)))
+        self.commit(translate("draft","Copy" if copy else "Scale"),
+            ['bimEdit_overrides.batchScale("'+names+'",'+ \
+                    DraftVecUtils.toString(delta)+','+ \
+                    DraftVecUtils.toString(self.node[0])+edit+')'])
         self.finish()
 
     def scaleGhost(self,x,y,z,rel):
+        "previewing the scale on the shared transform of the ghosts"
         delta = Vector(x,y,z)
         if rel:
             delta = FreeCAD.DraftWorkingPlane.getGlobalCoords(delta)
-        self.ghost.scale(delta)
-        # calculate a correction factor depending on the scaling center
-        corr = Vector(self.node[0].x,self.node[0].y,self.node[0].z)
-        corr.scale(delta.x,delta.y,delta.z)
-        corr = (corr.sub(self.node[0])).negative()
-        self.ghost.move(corr)
-        self.ghost.on()
+        ## Scaling around the base point needs no correction
+        self.trans.center.setValue(self.node[0].x,self.node[0].y,
+                self.node[0].z)
+        self.trans.scaleFactor.setValue([delta.x,delta.y,delta.z])
 
     def action(self,arg):
         "scene event handler"
@@ -512,8 +689,6 @@ class bimScale(Modifier):
             if arg["Key"] == "ESCAPE":
                 self.finish()
         elif arg["Type"] == "SoLocation2Event": #mouse movement detection
-            if self.ghost:
-                self.ghost.off()
             self.point,ctrlPoint,info = getPoint(self,arg,sym=True)
         elif arg["Type"] == "SoMouseButtonEvent":
             if (arg["State"] == "DOWN") and (arg["Button"] == "BUTTON1"):
@@ -531,9 +706,12 @@ class bimScale(Modifier):
                 self.view.removeEventCallback("SoEvent",self.call)
             self.task = DraftGui.ScaleTaskPanel()
             self.task.sourceCmd = self
+            ## A clone would hide the originals and break the Arch model:
+            ## objects are always scaled directly
+            if getattr(self.task,"isClone",None):
+                self.task.isClone.setChecked(False)
+                self.task.isClone.hide()
             DraftGui.todo.delay(FreeCADGui.Control.showDialog,self.task)
-            if self.ghost:
-                self.ghost.on()
         elif len(self.node) == 2:
             msg(translate("draft", "Pick new distance from base point:")+"\n")
         elif len(self.node) == 3:
@@ -550,34 +728,138 @@ class bimScale(Modifier):
                     self.task.setValue(d2/d1)
 
 
-
-def scale(objectslist,delta=Vector(1,1,1),center=Vector(0,0,0),copy=False,legacy=False):
-    '''scale(objects,vector,[center,copy,legacy]): Scales the objects contained
+def scalePoints(points,delta,center,placement=None):
+    '''scalePoints(points,delta,center,[placement]): Scales at once a list
+    of points by delta around center, as a single array operation.
+    If placement is given the points are expressed in its coordinates
+    (like the Points of a Wire) and so are the returned ones.'''
+    import numpy
+    pts = numpy.array([[p.x,p.y,p.z] for p in points],dtype=float)
+    if placement:
+        ## Rows of rot are the images of the axes: local.dot(rot) is global
+        rot = numpy.array([[v.x,v.y,v.z] for v in [
+            placement.Rotation.multVec(Vector(1,0,0)),
+            placement.Rotation.multVec(Vector(0,1,0)),
+            placement.Rotation.multVec(Vector(0,0,1))]])
+        base = numpy.array([placement.Base.x,placement.Base.y,
+            placement.Base.z])
+        pts = pts.dot(rot) + base
+    c = numpy.array([center.x,center.y,center.z])
+    pts = (pts - c) * numpy.array([delta.x,delta.y,delta.z]) + c
+    if placement:
+        pts = (pts - base).dot(rot.T)
+    return [Vector(*p) for p in pts.tolist()]
+
+def scaleSketch(obj,delta,center):
+    '''scaleSketch(obj,delta,center): Scales the geometry of a sketch 
+    around center, together with its dimensional constraints so that the
+    solver keeps the new size. Only uniform scales in the sketch plane 
+    are possible.'''
+    normal = obj.Placement.Rotation.multVec(Vector(0,0,1))
+    if abs(abs(normal.z) - 1) < 1e-7:
+        ## Horizontal sketch: only its plane matters
+        factors = [delta.x,delta.y]
+    else:
+        factors = [delta.x,delta.y,delta.z]
+    if min(factors) <= 0 or max(factors) - min(factors) > 1e-7:
+        FreeCAD.Console.PrintWarning(translate("draft", 
+            "Sketches can only be scaled uniformly: ")+obj.Label+"\n")
+        return
+    factor = factors[0]
+    c = obj.Placement.inverse().multVec(center)
+    geometry = []
+    for g in obj.Geometry:
+        g = g.copy()
+        g.scale(c,factor)
+        geometry.append(g)
+    obj.Geometry = geometry
+    for i, cst in enumerate(obj.Constraints):
+        if cst.Type in ["Distance","DistanceX","DistanceY","Radius",
+                "Diameter"]:
+            obj.setDatum(i,cst.Value*factor)
+    obj.solve()
+
+## Dimensions of the Arch objects scale() can handle, along the local x, y 
+## and z axes, and the ones still used when they are built on a Base
+archDimensions = {
+        'Wall': (('Length','Width','Height'), ('Width','Height')),
+        'Structure': (('Length','Width','Height'), ('Height',)),
+        }
+
+def scaleArch(obj,delta,center):
+    '''scaleArch(obj,delta,center): Scales an Arch object around center
+    through its dimensions (see archDimensions) and placement: its shape 
+    is rebuilt at every recompute, so it can't be scaled directly. Objects 
+    built on a Base get their length and position from it: they only take
+    uniform scales, applied to the other dimensions. Scales that would 
+    skew the object are refused.'''
+    dimensions, based = archDimensions[Draft.getType(obj)]
+    if getattr(obj,"Base",None):
+        if max(delta) - min(delta) > 1e-7:
+            FreeCAD.Console.PrintWarning(translate("draft", 
+                "Objects with a base can only be scaled uniformly: ")+ \
+                        obj.Label+"\n")
+            return
+        factors = dict((d,delta.x) for d in based)
+    else:
+        factors = {}
+        for d, axis in zip(dimensions,[Vector(1,0,0),Vector(0,1,0),
+                Vector(0,0,1)]):
+            a = obj.Placement.Rotation.multVec(axis)
+            s = Vector(a.x*delta.x,a.y*delta.y,a.z*delta.z)
+            if s.cross(a).Length > 1e-7*s.Length:
+                FreeCAD.Console.PrintWarning(translate("draft", 
+                    "Scale not aligned to the object axes: ")+ \
+                            obj.Label+"\n")
+                return
+            factors[d] = s.Length
+        pl = obj.Placement.copy()
+        d = pl.Base.sub(center)
+        pl.Base = center.add(Vector(d.x*delta.x,d.y*delta.y,d.z*delta.z))
+        obj.Placement = pl
+    for d, f in factors.items():
+        if hasattr(obj,d):
+            setattr(obj,d,getattr(obj,d)*f)
+
+def scale(objectslist,delta=Vector(1,1,1),center=Vector(0,0,0),copy=False):
+    '''scale(objects,vector,[center,copy]): Scales the objects contained
     in objects (that can be a list of objects or an object) of the given scale
     factors defined by the given vector (in X, Y and Z directions) around
-    given center. If legacy is True, direct (old) mode is used, otherwise
-    a parametric copy is made. If copy is True, the actual objects are not moved,
-    but copies are created instead. The objects (or their copies) are returned.'''
+    given center, in direct (legacy) mode: parametric clones are not made
+    (see bimScale.numericInput). If copy is True, the actual objects are not 
+    moved, but copies are created instead. The objects (or their copies) are 
+    returned.'''
     if not isinstance(objectslist,list): objectslist = [objectslist]
-    if legacy:
-        newobjlist = []
-        for obj in objectslist:
-            if copy:
-                newobj = makeCopy(obj)
-            else:
-                newobj = obj
-            if obj.isDerivedFrom("Part::Feature"):
-                sh = obj.Shape.copy()
-                m = FreeCAD.Matrix()
-                m.scale(delta)
-                sh = sh.transformGeometry(m)
-                corr = Vector(center.x,center.y,center.z)
-                corr.scale(delta.x,delta.y,delta.z)
-                corr = (corr.sub(center)).negative()
-                sh.translate(corr)
-            if getType(obj) == "Rectangle":
-                p = []
-                for v in sh.Vertexes: p.append(v.Point)
+    newobjlist = []
+    for obj in objectslist:
+        if copy:
+            newobj = Draft.makeCopy(obj)
+        else:
+            newobj = obj
+        typ = Draft.getType(obj)
+        if typ in ["Wire","BSpline"]:
+            newobj.Points = scalePoints(obj.Points,delta,center,
+                    obj.Placement)
+        elif typ == "Sketch":
+            scaleSketch(newobj,delta,center)
+        elif typ in archDimensions:
+            scaleArch(newobj,delta,center)
+        elif getattr(getattr(obj,"Proxy",None),"__module__","")\
+                .startswith("Arch"):
+            FreeCAD.Console.PrintWarning(translate("draft", 
+                "This kind of Arch object can't be scaled: ")+ \
+                        obj.Label+"\n")
+        elif obj.isDerivedFrom("Part::Feature"):
+            sh = obj.Shape.copy()
+            m = FreeCAD.Matrix()
+            m.scale(delta)
+            sh = sh.transformGeometry(m)
+            corr = Vector(center.x,center.y,center.z)
+            corr.scale(delta.x,delta.y,delta.z)
+            corr = (corr.sub(center)).negative()
+            sh.translate(corr)
+            if typ == "Rectangle":
+                p = [v.Point for v in sh.Vertexes]
                 pl = obj.Placement.copy()
                 pl.Base = p[0]
                 diag = p[2].sub(p[0])
@@ -591,53 +873,20 @@ def scale(objectslist,delta=Vector(1,1,1),center=Vector(0,0,0),copy=False,legacy
                 else: h = nh.Length
                 newobj.Length = l
                 newobj.Height = h
-                tr = p[0].sub(obj.Shape.Vertexes[0].Point)
                 newobj.Placement = pl
-            elif getType(obj) == "Wire":
-                p = []
-                for v in sh.Vertexes: p.append(v.Point)
-                #print(p)
-                newobj.Points = p
-            elif getType(obj) == "BSpline":
-                p = []
-                for p1 in obj.Points:
-                    p2 = p1.sub(center)
-                    p2.scale(delta.x,delta.y,delta.z)
-                    p.append(p2)
-                newobj.Points = p
-            elif (obj.isDerivedFrom("Part::Feature")):
+            else:
                 newobj.Shape = sh
-            elif (obj.TypeId == "App::Annotation"):
-                factor = delta.y * obj.ViewObject.FontSize
-                newobj.ViewObject.FontSize = factor
-                d = obj.Position.sub(center)
-                newobj.Position = center.add(Vector(d.x*delta.x,d.y*delta.y,d.z*delta.z))
-            if copy:
-                formatObject(newobj,obj)
-            newobjlist.append(newobj)
-        if copy and getParam("selectBaseObjects",False):
-            select(objectslist)
-        else:
-            select(newobjlist)
-        if len(newobjlist) == 1: return newobjlist[0]
-        return newobjlist
+        elif (obj.TypeId == "App::Annotation"):
+            factor = delta.y * obj.ViewObject.FontSize
+            newobj.ViewObject.FontSize = factor
+            d = obj.Position.sub(center)
+            newobj.Position = center.add(Vector(d.x*delta.x,d.y*delta.y,d.z*delta.z))
+        if copy:
+            Draft.formatObject(newobj,obj)
+        newobjlist.append(newobj)
+    if copy and Draft.getParam("selectBaseObjects",False):
+        Draft.select(objectslist)
     else:
-        obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython","Scale")
-        _Clone(obj)
-        obj.Objects = objectslist
-        obj.Scale = delta
-        corr = Vector(center.x,center.y,center.z)
-        corr.scale(delta.x,delta.y,delta.z)
-        corr = (corr.sub(center)).negative()
-        p = obj.Placement
-        p.move(corr)
-        obj.Placement = p
-        if not copy:
-            for o in objectslist:
-                o.ViewObject.hide()
-        if gui:
-            _ViewProviderClone(obj.ViewObject)
-            formatObject(obj,objectslist[-1])
-            select(obj)
-        return obj
-
+        Draft.select(newobjlist)
+    if len(newobjlist) == 1: return newobjlist[0]
+    return newobjlist
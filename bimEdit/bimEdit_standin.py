@@ -0,0 +1,1024 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#*******************************************************************************
+#*  (c) Marco Ferrara - https://github.com/marzof/ - 2019                      *
+#*                                                                             *
+#*  This program is free software: you can redistribute it and/or modify       *
+#*  it under the terms of the GNU General Public License as published by       *
+#*  the Free Software Foundation, either version 3 of the License, or          *
+#*  (at your option) any later version.                                        *
+#*                                                                             *
+#*  This program is distributed in the hope that it will be useful,            *
+#*  but WITHOUT ANY WARRANTY; without even the implied warranty of             *
+#*  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the              *
+#*  GNU General Public License for more details                                *
+#*                                                                             *
+#*  You should have received a copy of the GNU General Public License          *
+#*  along with this program.  If not, see <https://www.gnu.org/licenses/>.     *
+#*                                                                             *
+#*******************************************************************************
+
+## Headless stand-in for the parts of FreeCAD, FreeCADGui, Draft, Part, pivy
+## and PySide that bimEdit touches.
+##
+## It is meant for benchmarks only (see bimEdit_bench.py): documents, objects,
+## view objects and coin nodes behave enough like the real ones to run
+## selection graph building, ghost creation, selection cycling, replica and
+## move/rotate commits on a box without FreeCAD or a display.
+## Calling install() puts the stand-in modules in sys.modules.
+
+import sys, types, re, math, collections
+
+### Event loop ###
+
+tasks = collections.deque() ## Callables waiting for the event loop
+
+def processEvents():
+    ''' Run the pending tasks (delayed calls and timers) '''
+    while tasks:
+        tasks.popleft()()
+
+### pivy.coin ###
+
+class SoField:
+    def __init__(self, value=None):
+        self.value = value
+
+    def setValue(self, *args):
+        self.value = args[0] if len(args) == 1 else args
+
+    def getValue(self):
+        return self.value
+
+    def setValues(self, *args):
+        self.value = list(args[-1])
+
+    def getValues(self):
+        return self.value
+
+    def getNum(self):
+        return len(self.value) if self.value else 0
+
+class SoNode:
+    fields = ()
+
+    def __init__(self):
+        for f in self.fields:
+            setattr(self, f, SoField())
+        self.notify = True
+
+    @classmethod
+    def getClassTypeId(cls):
+        return cls
+
+    def getTypeId(self):
+        return type(self)
+
+    def getNodeId(self):
+        return id(self)
+
+    def isOfType(self, typ):
+        return isinstance(self, typ)
+
+    def enableNotify(self, flag):
+        self.notify = flag
+
+    def isNotifyEnabled(self):
+        return self.notify
+
+    def touch(self):
+        pass
+
+    def copy(self, memo=None):
+        ''' Deep copy keeping shared nodes shared '''
+        if memo is None:
+            memo = {}
+        if id(self) in memo:
+            return memo[id(self)]
+        new = type(self)()
+        memo[id(self)] = new
+        for f in self.fields:
+            value = getattr(self, f).value
+            getattr(new, f).value = list(value) \
+                    if isinstance(value, list) else value
+        if isinstance(self, SoGroup):
+            new.children = [c.copy(memo) for c in self.children]
+        return new
+
+class SoGroup(SoNode):
+    def __init__(self):
+        super().__init__()
+        self.children = []
+
+    def addChild(self, node):
+        self.children.append(node)
+
+    def insertChild(self, node, index):
+        self.children.insert(index, node)
+
+    def removeChild(self, node):
+        if isinstance(node, int):
+            del self.children[node]
+        else:
+            self.children.remove(node)
+
+    def replaceChild(self, index, node):
+        self.children[index] = node
+
+    def getChild(self, index):
+        return self.children[index]
+
+    def getChildren(self):
+        return list(self.children)
+
+    def getNumChildren(self):
+        return len(self.children)
+
+    def findChild(self, node):
+        for i, c in enumerate(self.children):
+            if c is node:
+                return i
+        return -1
+
+class SoSeparator(SoGroup): pass
+class SoAnnotation(SoSeparator): pass
+
+class SoSwitch(SoGroup):
+    fields = ('whichChild',)
+
+class SoTransform(SoNode):
+    fields = ('translation', 'rotation', 'center', 'scaleFactor')
+
+class SoMaterial(SoNode):
+    fields = ('diffuseColor', 'emissiveColor', 'transparency')
+
+class SoDrawStyle(SoNode):
+    fields = ('lineWidth', 'pointSize', 'style')
+
+class SoShapeHints(SoNode):
+    fields = ('vertexOrdering',)
+
+class SoPickStyle(SoNode):
+    fields = ('style',)
+    SHAPE, BOUNDING_BOX, UNPICKABLE = range(3)
+
+class SoCoordinate3(SoNode):
+    fields = ('point',)
+
+class SoShape(SoNode): pass
+
+class SoIndexedFaceSet(SoShape):
+    fields = ('coordIndex',)
+
+class SoIndexedLineSet(SoShape):
+    fields = ('coordIndex',)
+
+class SoPointSet(SoShape):
+    fields = ('numPoints',)
+
+class SoBaseKit(SoNode):
+    @staticmethod
+    def setSearchingChildren(flag):
+        pass
+
+class SoPath:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def getTail(self):
+        return self.nodes[-1]
+
+    def getNodeFromTail(self, i):
+        return self.nodes[-1 - i]
+
+    def getLength(self):
+        return len(self.nodes)
+
+class SoSearchAction:
+    ALL = 2
+
+    def __init__(self):
+        self.typ = None
+        self.paths = []
+
+    def setType(self, typ, derived=True):
+        self.typ = typ
+
+    def setInterest(self, interest):
+        pass
+
+    def setSearchingAll(self, flag):
+        pass
+
+    def apply(self, root):
+        self.paths = []
+        stack = [[root]]
+        while stack:
+            path = stack.pop()
+            node = path[-1]
+            if isinstance(node, self.typ):
+                self.paths.append(SoPath(path))
+            if isinstance(node, SoGroup):
+                stack += [path + [c] for c in reversed(node.children)]
+
+    def getPaths(self):
+        return self.paths
+
+class SoInput:
+    def setBuffer(self, buf):
+        self.buffer = buf
+
+class SoDB:
+    @staticmethod
+    def readAll(buf):
+        ## The buffer of Shape.writeInventor is a number of triangles
+        return makeRootNode(int(buf.buffer))
+
+class SbVec3f:
+    def __init__(self, *args):
+        self.value = args
+
+def makeRootNode(triangles):
+    ''' Build a coin representation like the one of a Part view provider:
+    flat lines display mode with faces, edges and vertices '''
+    root = SoSeparator()
+    root.addChild(SoTransform())
+    modes = SoSwitch()
+    modes.whichChild.setValue(0)
+    flatLines = SoSeparator()
+    points = SoCoordinate3()
+    points.point.setValue([(float(i), 0., 0.) for i in range(triangles + 2)])
+    flatLines.addChild(points)
+    for shape in [SoIndexedFaceSet, SoIndexedLineSet, SoPointSet]:
+        sep = SoSeparator()
+        sep.addChild(SoMaterial())
+        sep.addChild(SoDrawStyle())
+        if shape is SoIndexedFaceSet:
+            sep.addChild(SoShapeHints())
+        node = shape()
+        if shape is SoIndexedFaceSet:
+            node.coordIndex.setValue([j for i in range(triangles) \
+                    for j in (i, i + 1, i + 2, -1)])
+        elif shape is SoIndexedLineSet:
+            node.coordIndex.setValue([j for i in range(triangles) \
+                    for j in (i, i + 1, -1)])
+        sep.addChild(node)
+        flatLines.addChild(sep)
+    modes.addChild(flatLines)
+    root.addChild(modes)
+    return root
+
+### FreeCAD ###
+
+class Vector:
+    def __init__(self, x=0., y=0., z=0.):
+        if isinstance(x, Vector):
+            x, y, z = x.x, x.y, x.z
+        self.x, self.y, self.z = float(x), float(y), float(z)
+
+    def __repr__(self):
+        return 'Vector ({}, {}, {})'.format(self.x, self.y, self.z)
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+    def __eq__(self, other):
+        return isinstance(other, Vector) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def add(self, v):
+        return Vector(self.x + v.x, self.y + v.y, self.z + v.z)
+
+    def sub(self, v):
+        return Vector(self.x - v.x, self.y - v.y, self.z - v.z)
+
+    __add__ = add
+    __sub__ = sub
+
+    def __mul__(self, f):
+        return Vector(self.x * f, self.y * f, self.z * f)
+
+    def multiply(self, f):
+        self.x, self.y, self.z = self.x * f, self.y * f, self.z * f
+        return self
+
+    def scale(self, x, y, z):
+        self.x, self.y, self.z = self.x * x, self.y * y, self.z * z
+        return self
+
+    def negative(self):
+        return Vector(-self.x, -self.y, -self.z)
+
+    def dot(self, v):
+        return self.x * v.x + self.y * v.y + self.z * v.z
+
+    def cross(self, v):
+        return Vector(self.y * v.z - self.z * v.y, self.z * v.x - self.x * v.z,
+                self.x * v.y - self.y * v.x)
+
+    @property
+    def Length(self):
+        return math.sqrt(self.dot(self))
+
+class Rotation:
+    def __init__(self, axis=None, angle=0.):
+        self.Axis = axis or Vector(0, 0, 1)
+        self.Angle = angle
+
+    def multVec(self, v):
+        c, s = math.cos(self.Angle), math.sin(self.Angle)
+        return Vector(c * v.x - s * v.y, s * v.x + c * v.y, v.z)
+
+class BoundBox:
+    def __init__(self, low, high):
+        self.XMin, self.YMin, self.ZMin = low
+        self.XMax, self.YMax, self.ZMax = high
+
+class Vertex:
+    def __init__(self, point):
+        self.Point = point
+
+class Edge:
+    def __init__(self, a, b):
+        self.Vertexes = [Vertex(a), Vertex(b)]
+
+    def discretize(self, **kwargs):
+        return [v.Point for v in self.Vertexes]
+
+class Shape:
+    ''' The box of a wall-like object, triangles long, starting at start '''
+    def __init__(self, triangles, start=0.):
+        self.triangles = triangles
+        self.Placement = Placement()
+        self.Solids = [self]
+        self.BoundBox = BoundBox((start, 0., 0.),
+                (start + triangles + 1., 200., 3000.))
+        bb = self.BoundBox
+        points = [Vector(x, y, z) for z in (bb.ZMin, bb.ZMax) \
+                for y in (bb.YMin, bb.YMax) for x in (bb.XMin, bb.XMax)]
+        self.Vertexes = [Vertex(p) for p in points]
+        self.Edges = [Edge(points[i], points[j]) for i, j in [(0, 1),
+            (1, 3), (3, 2), (2, 0), (4, 5), (5, 7), (7, 6), (6, 4),
+            (0, 4), (1, 5), (2, 6), (3, 7)]]
+
+    def isNull(self):
+        return False
+
+    def copy(self):
+        shape = Shape(self.triangles, self.BoundBox.XMin)
+        shape.Placement = self.Placement.copy()
+        return shape
+
+    def extrude(self, vector):
+        ## Profiles are boxes already
+        return self.copy()
+
+    def cut(self, tool):
+        ## The faces of the tool are added to the result
+        shape = self.copy()
+        shape.triangles += tool.triangles
+        return shape
+
+    def writeInventor(self):
+        return str(self.triangles)
+
+class Placement:
+    def __init__(self, base=None, rotation=None):
+        self.Base = base or Vector()
+        self.Rotation = rotation or Rotation()
+
+    def copy(self):
+        return Placement(Vector(self.Base),
+                Rotation(self.Rotation.Axis, self.Rotation.Angle))
+
+    def move(self, v):
+        self.Base = self.Base.add(v)
+
+    def multiply(self, p):
+        return Placement(self.Base.add(self.Rotation.multVec(p.Base)),
+                Rotation(self.Rotation.Axis,
+                    self.Rotation.Angle + p.Rotation.Angle))
+
+    def inverse(self):
+        rot = Rotation(self.Rotation.Axis, -self.Rotation.Angle)
+        return Placement(rot.multVec(self.Base).negative(), rot)
+
+    def multVec(self, v):
+        return self.Rotation.multVec(v).add(self.Base)
+
+class Console:
+    messages = []
+
+    @classmethod
+    def PrintMessage(cls, text):
+        cls.messages.append(text)
+
+    PrintWarning = PrintMessage
+    PrintError = PrintMessage
+    PrintLog = PrintMessage
+
+class ViewObject:
+    def __init__(self, obj, triangles):
+        self.__dict__.update({'Object': obj, 'Transparency': 0,
+            'DisplayMode': 'Flat Lines', 'LineWidth': 2.0, 'Visibility': True,
+            'changes': 0})
+        self.RootNode = makeRootNode(triangles)
+
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        self.__dict__['changes'] += 1
+
+    def hide(self):
+        self.Visibility = False
+
+class DocumentObject:
+    ''' A document object: properties listed in PropertiesList notify the
+    document observers when they change '''
+    linkProperties = ('Base', 'Additions', 'Hosts')
+
+    def __init__(self, doc, name, typ, triangles=48):
+        d = self.__dict__
+        d.update({'Document': doc, 'Name': name, 'Label': name,
+            'TypeId': typ, 'Proxy': None, 'touched': True,
+            'Shape': Shape(triangles, 500. * len(doc.objects)),
+            'PropertiesList': ['Label', 'Placement', 'ExpressionEngine'],
+            'Placement': Placement(), 'ExpressionEngine': []})
+        d['ViewObject'] = ViewObject(self, triangles)
+
+    def __repr__(self):
+        return '<DocumentObject {}>'.format(self.Name)
+
+    def addProperty(self, name, value=None):
+        self.PropertiesList.append(name)
+        self.__dict__[name] = None
+        setattr(self, name, value)
+
+    def __setattr__(self, name, value):
+        if name in self.linkProperties:
+            self.Document.unlink(self)
+        self.__dict__[name] = value
+        if name in self.linkProperties or name == 'ExpressionEngine':
+            self.Document.link(self)
+        if name in self.PropertiesList:
+            self.__dict__['touched'] = True
+            self.Document.notify('slotChangedObject', self, name)
+
+    def setExpression(self, prop, expr):
+        engine = [e for e in self.ExpressionEngine if e[0] != prop]
+        self.ExpressionEngine = engine + [(prop, expr)]
+
+    @property
+    def OutList(self):
+        return [self.Document.getObject(n) for n in self.Document.outs(self)]
+
+    @property
+    def InList(self):
+        return [self.Document.getObject(n) \
+                for n in self.Document.ins.get(self.Name, ())]
+
+    def isDerivedFrom(self, typ):
+        return typ == 'Part::Feature' and 'Part::' in self.TypeId
+
+    def touch(self):
+        self.__dict__['touched'] = True
+
+class Document:
+    def __init__(self, name):
+        self.Name = name
+        self.Label = name
+        self.objects = {}
+        self.ins = {} ## Object name -> names of objects linking to it
+        self.transactions = []
+        self.recomputed = 0
+
+    @property
+    def Objects(self):
+        return list(self.objects.values())
+
+    def getObject(self, name):
+        return self.objects.get(name)
+
+    def getObjectsByLabel(self, label):
+        return [o for o in self.objects.values() if o.Label == label]
+
+    def uniqueName(self, name):
+        if name not in self.objects:
+            return name
+        base = re.sub(r'\d+$', '', name)
+        if base not in self.objects:
+            return base
+        counters = self.__dict__.setdefault('counters', {})
+        i = counters.get(base, 0)
+        while True:
+            i += 1
+            candidate = '{}{:03d}'.format(base, i)
+            if candidate not in self.objects:
+                counters[base] = i
+                return candidate
+
+    def addObject(self, typ, name, triangles=48):
+        obj = DocumentObject(self, self.uniqueName(name), typ, triangles)
+        self.objects[obj.Name] = obj
+        notify('slotCreatedObject', obj)
+        return obj
+
+    def copyObject(self, obj, with_dependencies=False):
+        if isinstance(obj, (list, tuple)):
+            copies = [self.copyObject(o) for o in obj]
+            memo = {o.Name: c for o, c in zip(obj, copies)}
+            for c in copies:
+                if 'Base' in c.PropertiesList and c.Base \
+                        and c.Base.Name in memo:
+                    c.Base = memo[c.Base.Name]
+                if 'Additions' in c.PropertiesList and c.Additions:
+                    c.Additions = [memo.get(a.Name, a) for a in c.Additions]
+            return copies
+        ## Properties are restored, not changed: no observer is notified
+        new = self.addObject(obj.TypeId, obj.Name)
+        for prop in obj.PropertiesList:
+            if prop not in new.PropertiesList:
+                new.PropertiesList.append(prop)
+            value = getattr(obj, prop)
+            if prop == 'Placement':
+                value = value.copy()
+            elif isinstance(value, list):
+                value = list(value)
+            new.__dict__[prop] = value
+        new.__dict__['Proxy'] = obj.Proxy
+        self.link(new)
+        new.ViewObject.__dict__['RootNode'] = obj.ViewObject.RootNode.copy()
+        return new
+
+    def removeObject(self, name):
+        obj = self.objects.pop(name)
+        self.unlink(obj)
+        notify('slotDeletedObject', obj)
+
+    def outs(self, obj):
+        names = set()
+        if getattr(obj, 'Base', None):
+            names.add(obj.Base.Name)
+        for a in (getattr(obj, 'Additions', None) or []) + \
+                (getattr(obj, 'Hosts', None) or []):
+            names.add(a.Name)
+        for prop, expr in obj.ExpressionEngine:
+            for label, name in re.findall(r'(?:<<(.*?)>>|([A-Za-z_]\w*))\s*\.',
+                    expr):
+                if label:
+                    name = next((o.Name for o in self.getObjectsByLabel(label)),
+                            None)
+                if name in self.objects:
+                    names.add(name)
+        names.discard(obj.Name)
+        return names
+
+    def link(self, obj):
+        for name in self.outs(obj):
+            self.ins.setdefault(name, set()).add(obj.Name)
+
+    def unlink(self, obj):
+        for name in self.outs(obj):
+            self.ins.get(name, set()).discard(obj.Name)
+
+    def notify(self, slot, obj, prop):
+        notify(slot, obj, prop)
+
+    def openTransaction(self, name='Command'):
+        self.transactions.append(name)
+
+    def commitTransaction(self):
+        pass
+
+    def abortTransaction(self):
+        pass
+
+    def recompute(self, objs=None):
+        objs = self.Objects if objs is None else objs
+        for o in objs:
+            if o.touched:
+                o.__dict__['touched'] = False
+                self.recomputed += 1
+        return len(objs)
+
+documents = {}
+observers = []
+
+def notify(slot, *args):
+    for obs in list(observers):
+        if hasattr(obs, slot):
+            getattr(obs, slot)(*args)
+
+def newDocument(name='Unnamed'):
+    doc = Document(name)
+    documents[name] = doc
+    FreeCAD.ActiveDocument = doc
+    FreeCADGui.ActiveDocument = GuiDocument(doc)
+    return doc
+
+def closeDocument(name):
+    doc = documents.pop(name)
+    notify('slotDeletedDocument', doc)
+    if FreeCAD.ActiveDocument is doc:
+        FreeCAD.ActiveDocument = None
+        FreeCADGui.ActiveDocument = None
+
+### FreeCADGui ###
+
+class View3D:
+    def __init__(self):
+        self.sceneGraph = SoSeparator()
+        self.callbacks = {}
+
+    def getSceneGraph(self):
+        return self.sceneGraph
+
+    def addEventCallback(self, typ, func):
+        self.callbacks[id(func)] = (typ, func)
+        return func
+
+    def removeEventCallback(self, typ, func):
+        self.callbacks.pop(id(func), None)
+
+    def getViewDirection(self):
+        return Vector(0, 0, -1)
+
+    def getPoint(self, *pos):
+        pos = pos[0] if len(pos) == 1 else pos
+        return Vector(pos[0], pos[1], 0)
+
+    def getPointOnScreen(self, *v):
+        v = v[0] if len(v) == 1 else Vector(*v)
+        return (int(v.x), int(v.y))
+
+    def getCamera(self):
+        return 'camera'
+
+    def redraw(self):
+        pass
+
+class GuiDocument:
+    def __init__(self, doc):
+        self.Document = doc
+        self.ActiveView = View3D()
+
+    def getObject(self, name):
+        return self.Document.getObject(name).ViewObject
+
+class Selection:
+    selected = []
+
+    @classmethod
+    def getSelection(cls):
+        return list(cls.selected)
+
+    @classmethod
+    def clearSelection(cls):
+        cls.selected = []
+
+    @classmethod
+    def addSelection(cls, obj):
+        cls.selected.append(obj)
+
+    @classmethod
+    def removeSelection(cls, obj):
+        if obj in cls.selected:
+            cls.selected.remove(obj)
+
+commands = {} ## Registered Gui commands
+namespace = {} ## Python console namespace of doCommand
+
+def addModule(name):
+    namespace[name] = __import__(name)
+
+def doCommand(line):
+    namespace.setdefault('FreeCAD', FreeCAD)
+    namespace.setdefault('FreeCADGui', FreeCADGui)
+    exec(line, namespace)
+
+class Null:
+    ''' Falsy placeholder answering to any attribute or call '''
+    def __getattr__(self, name):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __bool__(self):
+        return False
+
+class Snapper:
+    ''' The Draft snapper: snap is on, with the snaps not in disabled '''
+    def __init__(self):
+        self.active = True
+        self.disabled = set()
+        self.tracker = Null()
+        self.mk = {'endpoint': 'circle', 'passive': 'empty'}
+
+    def isEnabled(self, but):
+        return but not in self.disabled
+
+class ToolBar(Null):
+    ''' The Draft toolbar (it has to be truthy) '''
+    def __bool__(self):
+        return True
+
+### Draft ###
+
+def getGroupContents(objs, **kwargs):
+    return list(objs)
+
+def extrusionData(proxy, obj):
+    ''' The base profile of obj extruded by its height, as 
+    ArchComponent.getExtrusionData gives it (None without a base) '''
+    if not getattr(obj, 'Base', None):
+        return None
+    height = Vector(0., 0., getattr(obj, 'Height', 0.))
+    return obj.Base.Shape.copy(), height, Placement()
+
+def archProxy(typ):
+    ''' Return the proxy of an Arch object of type typ (its class comes 
+    from module Arch<typ>) '''
+    return type('_' + typ, (), {'Type': typ, '__module__': 'Arch' + typ,
+        'getExtrusionData': extrusionData})()
+
+def getType(obj):
+    return getattr(obj.Proxy, 'Type', obj.TypeId)
+
+def keyEvent(key, state='UP', shift=False, ctrl=False):
+    ''' Return a keyboard event: as in Coin, with Shift held printable
+    keys come in upper case '''
+    return {'Type': 'SoKeyboardEvent', 'State': state, 'ShiftDown': shift,
+            'CtrlDown': ctrl, 'AltDown': False,
+            'Key': key.upper() if shift and len(key) == 1 else key}
+
+def get3DView():
+    return FreeCADGui.ActiveDocument.ActiveView
+
+def draftMove(objs, vector, copy=False):
+    for o in objs if isinstance(objs, list) else [objs]:
+        pl = o.Placement.copy()
+        pl.move(vector)
+        o.Placement = pl
+
+def draftRotate(objs, angle, center=Vector(), axis=Vector(0, 0, 1),
+        copy=False):
+    rot = Rotation(axis, math.radians(angle))
+    for o in objs if isinstance(objs, list) else [objs]:
+        pl = o.Placement.copy()
+        pl.Base = rot.multVec(pl.Base.sub(center)).add(center)
+        pl.Rotation = Rotation(axis, pl.Rotation.Angle + math.radians(angle))
+        o.Placement = pl
+
+class Todo:
+    ''' DraftGui.todo: delayed calls are run by doTasks in a later turn of
+    the event loop. As in DraftGui, a call delayed while doTasks is running
+    joins the list being run (no new turn of the event loop), and errors 
+    are printed as warnings (a transaction opened by a commit stays open) '''
+    def __init__(self):
+        self.itinerary = []
+        self.commitlist = []
+        self.afteritinerary = []
+
+    def call(self, f, arg):
+        try:
+            if arg or (arg is False):
+                f(arg)
+            else:
+                f()
+        except Exception as e:
+            FreeCAD.Console.PrintWarning('[Draft.todo.tasks] Unexpected ' + \
+                    'error: {!r} in {}({})\n'.format(e, f, arg))
+
+    def doTasks(self):
+        for f, arg in self.itinerary:
+            self.call(f, arg)
+        self.itinerary = []
+        for name, func in self.commitlist:
+            try:
+                FreeCAD.ActiveDocument.openTransaction(str(name))
+                if isinstance(func, list):
+                    for line in func:
+                        doCommand(line)
+                else:
+                    func()
+                FreeCAD.ActiveDocument.commitTransaction()
+            except Exception as e:
+                FreeCAD.Console.PrintWarning('[Draft.todo.commit] ' + \
+                        'Unexpected error: {!r} in {}\n'.format(e, func))
+        self.commitlist = []
+        for f, arg in self.afteritinerary:
+            self.call(f, arg)
+        self.afteritinerary = []
+
+    def delay(self, f, arg=None):
+        if not self.itinerary:
+            QTimer.singleShot(0, self.doTasks)
+        self.itinerary.append((f, arg))
+
+    def delayCommit(self, cl):
+        self.commitlist = cl
+        QTimer.singleShot(0, self.doTasks)
+
+    def delayAfter(self, f, arg=None):
+        if not self.afteritinerary:
+            QTimer.singleShot(0, self.doTasks)
+        self.afteritinerary.append((f, arg))
+
+todo = Todo()
+
+class DraftTool:
+    def __init__(self):
+        self.commitList = []
+        self.doc = None
+        self.node = []
+        self.call = None
+        self.ui = None
+        self.view = None
+        self.planetrack = None
+        self.extendedCopy = False
+        self.copymode = False
+
+    def Activated(self, name="None", noplanesetup=False, is_subtool=False):
+        if FreeCAD.activeDraftCommand and not is_subtool:
+            FreeCAD.activeDraftCommand.finish()
+        self.ui = FreeCADGui.draftToolBar
+        self.view = get3DView()
+        self.call = None
+        self.commitList = []
+        self.doc = FreeCAD.ActiveDocument
+        self.node = []
+        self.featureName = name
+        FreeCAD.activeDraftCommand = self
+
+    def finish(self, close=False):
+        self.node = []
+        FreeCAD.activeDraftCommand = None
+        if self.call:
+            self.view.removeEventCallback("SoEvent", self.call)
+            self.call = None
+        if self.commitList:
+            todo.delayCommit(self.commitList)
+        self.commitList = []
+
+    def commit(self, name, func):
+        self.commitList.append((name, func))
+
+class Modifier(DraftTool): pass
+class Move(Modifier): pass
+class Rotate(Modifier): pass
+
+class WorkingPlane:
+    axis = Vector(0, 0, 1)
+    u = Vector(1, 0, 0)
+    v = Vector(0, 1, 0)
+
+    def getGlobalCoords(self, v):
+        return v
+
+    def projectPoint(self, p, direction=None):
+        return Vector(p.x, p.y, 0)
+
+def getPoint(target, args, mobile=False, sym=False, workingplane=True,
+        noTracker=False):
+    pos = args["Position"]
+    return Vector(pos[0], pos[1], 0), None, None
+
+def toString(v):
+    return 'FreeCAD.Vector({},{},{})'.format(v.x, v.y, v.z)
+
+### DraftTrackers ###
+
+class Tracker:
+    def __init__(self, dotted=False, scolor=None, swidth=None, children=[],
+            ontop=False, name=None):
+        self.switch = SoSwitch()
+        self.switch.whichChild.setValue(-1)
+        node = SoSeparator()
+        for c in children:
+            node.addChild(c)
+        self.switch.addChild(node)
+        todo.delay(self._insertSwitch, self.switch)
+
+    def _insertSwitch(self, switch):
+        get3DView().getSceneGraph().addChild(switch)
+
+    def _removeSwitch(self, switch):
+        sg = get3DView().getSceneGraph()
+        if sg.findChild(switch) >= 0:
+            sg.removeChild(switch)
+
+    def on(self):
+        self.switch.whichChild.setValue(0)
+
+    def off(self):
+        self.switch.whichChild.setValue(-1)
+
+    def finalize(self):
+        todo.delay(self._removeSwitch, self.switch)
+        self.switch = None
+
+class ghostTracker(Tracker):
+    def __init__(self, sel, dotted=False, scolor=None, swidth=None):
+        self.trans = SoTransform()
+        self.children = [self.trans]
+        rootsep = SoSeparator()
+        for obj in sel if isinstance(sel, list) else [sel]:
+            rootsep.addChild(obj.ViewObject.RootNode.copy())
+        self.children.append(rootsep)
+        Tracker.__init__(self, dotted, scolor, swidth,
+                children=self.children, name="ghostTracker")
+
+    def move(self, delta):
+        self.trans.translation.setValue([delta.x, delta.y, delta.z])
+
+    def rotate(self, axis, angle):
+        self.trans.rotation.setValue([axis.x, axis.y, axis.z], angle)
+
+    def center(self, point):
+        self.trans.center.setValue(point.x, point.y, point.z)
+
+    def scale(self, delta):
+        self.trans.scaleFactor.setValue([delta.x, delta.y, delta.z])
+
+class arcTracker(Tracker):
+    def __init__(self, *args, **kwargs):
+        Tracker.__init__(self, children=[SoSeparator()])
+
+### PySide ###
+
+class QInputDialog:
+    ''' Dialogs are answered with count (if set) or their default value '''
+    count = None
+
+    @classmethod
+    def getInt(cls, parent, title, label, value=0, *args):
+        return (cls.count or value), True
+
+class QTimer:
+    @staticmethod
+    def singleShot(ms, func):
+        tasks.append(func)
+
+### Installation ###
+
+def module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+def coinNames():
+    return {k: v for k, v in globals().items() \
+            if k.startswith('So') or k.startswith('Sb')}
+
+FreeCAD = FreeCADGui = None
+
+def install():
+    ''' Put the stand-in modules in sys.modules (replacing FreeCAD ones) '''
+    global FreeCAD, FreeCADGui
+    FreeCAD = module('FreeCAD', Vector=Vector, Placement=Placement,
+            Rotation=Rotation, Console=Console, ActiveDocument=None,
+            activeDocument=lambda: FreeCAD.ActiveDocument,
+            getDocument=lambda name: documents[name],
+            listDocuments=lambda: dict(documents),
+            newDocument=newDocument, closeDocument=closeDocument,
+            addDocumentObserver=observers.append,
+            removeDocumentObserver=observers.remove,
+            activeDraftCommand=None, GuiUp=True,
+            DraftWorkingPlane=WorkingPlane())
+    FreeCAD.Base = FreeCAD
+    FreeCADGui = module('FreeCADGui', Selection=Selection,
+            ActiveDocument=None, addModule=addModule, doCommand=doCommand,
+            draftToolBar=ToolBar(), Control=Null(), Snapper=Snapper(),
+            addCommand=commands.__setitem__,
+            listCommands=lambda: list(commands),
+            runCommand=lambda name: commands[name].Activated())
+    module('Part', makeCompound=lambda shapes: None)
+    module('Draft', getGroupContents=getGroupContents, getType=getType,
+            get3DView=get3DView, move=draftMove, rotate=draftRotate,
+            select=lambda objs: None, formatObject=lambda *a: None,
+            getParam=lambda name, default=None: default)
+    module('DraftGui', translate=lambda ctx, text, utf8_decode=False: text,
+            utf8_decode=lambda text: text, todo=todo,
+            ScaleTaskPanel=Null)
+    module('DraftVecUtils', toString=toString)
+    module('DraftTools', Modifier=Modifier, Move=Move, Rotate=Rotate,
+            msg=lambda text, mode=None: None, selectObject=lambda arg: None,
+            plane=WorkingPlane(), getPoint=getPoint,
+            redraw3DView=lambda: None,
+            hasMod=lambda arg, mod: bool(arg.get(mod + 'Down')),
+            MODALT='Alt', MODCONSTRAIN='Shift', MODSNAP='Ctrl',
+            DraftVecUtils=sys.modules['DraftVecUtils'])
+    module('DraftTrackers', Tracker=Tracker, ghostTracker=ghostTracker,
+            arcTracker=arcTracker)
+    coin = module('pivy.coin', **coinNames())
+    module('pivy', coin=coin)
+    QtCore = module('PySide.QtCore', QTimer=QTimer,
+            QT_TRANSLATE_NOOP=lambda ctx, text: text)
+    QtGui = module('PySide.QtGui', QInputDialog=QInputDialog)
+    module('PySide', QtCore=QtCore, QtGui=QtGui)